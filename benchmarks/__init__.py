@@ -0,0 +1 @@
+# 基准测试工具
@@ -0,0 +1,272 @@
+"""
+备份流程基准测试：在临时目录中生成合成 WeChat 容器，测量全量同步、增量事件处理、
+去重命中率、数据库吞吐和头像缩略图加载，并以 JSON 输出结果，便于在不同提交之间比较。
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.run_benchmarks --chats 50 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .synthetic_container import ContainerSpec, generate_container
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 2) if seconds > 0 else None
+
+
+def _tree_stats(root):
+    """统计目录下的文件数、不同 inode 数和总字节数（按 inode 去重）"""
+    files = 0
+    inodes = {}
+    for dir_path, _, file_names in os.walk(root):
+        for name in file_names:
+            st = os.lstat(os.path.join(dir_path, name))
+            files += 1
+            inodes[(st.st_dev, st.st_ino)] = st.st_size
+    return files, len(inodes), sum(inodes.values())
+
+
+def bench_full_sync(source_dir, backup_dir):
+    from sync.copy_scheduler import CopyScheduler
+    from sync.config_store import flush
+    from sync.sync_logic import backup_file, process_directory
+
+    scheduler = CopyScheduler.from_config(lambda path, st, **kwargs: backup_file(path, backup_dir, source_dir, st, **kwargs))
+    start = time.perf_counter()
+    stats = process_directory(source_dir, backup_dir, source_dir, scheduler)
+    scheduler.join()
+    flush()
+    elapsed = time.perf_counter() - start
+    scheduler.shutdown()
+
+    files, unique, unique_bytes = _tree_stats(backup_dir)
+    return {
+        "seconds": round(elapsed, 4),
+        "candidates": stats.candidates,
+        "directories": stats.dirs,
+        "files_per_second": _rate(stats.candidates, elapsed),
+        "mb_per_second": _rate(unique_bytes / 1024 / 1024, elapsed),
+        "walk_seconds": round(stats.elapsed, 4),
+        "target_files": files,
+        "target_unique_inodes": unique,
+        "target_unique_bytes": unique_bytes,
+    }
+
+
+def bench_resync(source_dir, backup_dir):
+    """没有任何变化时再次全量核对的耗时"""
+    from sync.copy_scheduler import CopyScheduler
+    from sync.sync_logic import backup_file, process_directory
+
+    scheduler = CopyScheduler.from_config(lambda path, st, **kwargs: backup_file(path, backup_dir, source_dir, st, **kwargs))
+    start = time.perf_counter()
+    stats = process_directory(source_dir, backup_dir, source_dir, scheduler)
+    scheduler.join()
+    elapsed = time.perf_counter() - start
+    scheduler.shutdown()
+    return {
+        "seconds": round(elapsed, 4),
+        "files_per_second": _rate(stats.candidates, elapsed),
+    }
+
+
+def bench_incremental_events(source_dir, backup_dir, media_dirs, count, seed):
+    """模拟 WeChat 写入新文件，通过事件管道逐个处理"""
+    from sync import work_journal
+    from sync.copy_scheduler import CopyScheduler
+    from sync.event_pipeline import EventPipeline
+    from sync.sync_logic import backup_file, process_file
+
+    rng = random.Random(seed)
+    scheduler = CopyScheduler.from_config(lambda path, st, **kwargs: backup_file(path, backup_dir, source_dir, st, **kwargs))
+    # pending_count 归零时最后一个回调可能还没有把文件交给调度器，按回调完成的文件数等待
+    handled = set()
+    all_handled = threading.Event()
+
+    def handle(path):
+        process_file(path, backup_dir, source_dir, scheduler)
+        handled.add(path)
+        if len(handled) >= count:
+            all_handled.set()
+
+    pipeline = EventPipeline(handle, debounce_seconds=0.05, settle_seconds=0.02)
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(rng.choice(media_dirs), f"bench_new_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(rng.getrandbits(20 * 1024 * 8).to_bytes(20 * 1024, "little"))
+        paths.append(path)
+
+    start = time.perf_counter()
+    # 每个文件产生 created + 多次 modified 事件，验证事件合并
+    for path in paths:
+        # 与 WeChatBackupHandler.submit 一致，先登记到持久化队列
+        work_journal.discover(path)
+        for _ in range(3):
+            pipeline.submit(path)
+    if paths:
+        all_handled.wait()
+    scheduler.join()
+    elapsed = time.perf_counter() - start
+    pipeline.stop()
+    scheduler.shutdown()
+
+    return {
+        "events": count * 3,
+        "files": count,
+        "seconds": round(elapsed, 4),
+        "files_per_second": _rate(count, elapsed),
+    }
+
+
+def bench_database(ops):
+    from sync import config_store
+
+    start = time.perf_counter()
+    for i in range(ops):
+        config_store.set_file_hash(f"/bench/{i}", f"{i:064x}", "blake2b")
+    config_store.flush()
+    write_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(ops):
+        config_store.get_file_hash(f"/bench/{i}")
+    read_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(ops):
+        config_store.set_manifest(f"/bench/{i}", i, i, i)
+    config_store.flush()
+    manifest_seconds = time.perf_counter() - start
+
+    return {
+        "ops": ops,
+        "hash_writes_per_second": _rate(ops, write_seconds),
+        "hash_reads_per_second": _rate(ops, read_seconds),
+        "manifest_writes_per_second": _rate(ops, manifest_seconds),
+    }
+
+
+def bench_avatar_thumbnails(avatar_paths):
+    # Pillow 是必需依赖，导入 sync 包时已经加载
+    from sync.thumbnail_cache import ThumbnailCache
+
+    cache = ThumbnailCache()
+    result = {"avatars": len(avatar_paths)}
+    # 第一次为缓存未命中（降采样解码并写缓存），第二次全部命中磁盘缓存
+    for phase in ("cold", "warm"):
+        start = time.perf_counter()
+        for path in avatar_paths:
+            cache.load(path)
+        elapsed = time.perf_counter() - start
+        result[f"{phase}_seconds"] = round(elapsed, 4)
+        result[f"{phase}_avatars_per_second"] = _rate(len(avatar_paths), elapsed)
+    return result
+
+
+def _run_all(results, info, source_dir, backup_dir, args):
+    results["full_sync"] = bench_full_sync(source_dir, backup_dir)
+    full = results["full_sync"]
+    results["dedup"] = {
+        "expected_duplicates": info.duplicate_files,
+        "linked_files": full["target_files"] - full["target_unique_inodes"],
+        "hit_rate": round(1 - full["target_unique_inodes"] / full["target_files"], 4)
+        if full["target_files"] else None,
+    }
+    results["resync"] = bench_resync(source_dir, backup_dir)
+    results["incremental_events"] = bench_incremental_events(
+        source_dir, backup_dir, info.media_dirs, args.events, args.seed)
+    results["database"] = bench_database(args.db_ops)
+    results["avatar_thumbnails"] = bench_avatar_thumbnails(info.avatars)
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="wechat-backup-bench-")
+    source_dir = os.path.join(workdir, "container")
+    backup_dir = os.path.join(workdir, "backup")
+    # 数据库路径在导入 sync 包时确定，必须先设置环境变量
+    os.environ["WECHAT_BACKUP_HOME"] = os.path.join(workdir, "state")
+
+    spec = ContainerSpec(accounts=args.accounts, chats=args.chats, images=args.images,
+                         videos=args.videos, thumbs=args.thumbs,
+                         duplicate_ratio=args.duplicate_ratio, depth=args.depth, seed=args.seed)
+    start = time.perf_counter()
+    info = generate_container(source_dir, spec)
+    generate_seconds = time.perf_counter() - start
+
+    from sync.config_store import set_config
+    set_config("copy_workers", str(args.copy_workers))
+    set_config("large_copy_workers", str(args.large_copy_workers))
+
+    results = {}
+    # 备份过程中的逐文件输出会干扰 JSON 结果，统一丢弃
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            _run_all(results, info, source_dir, backup_dir, args)
+        finally:
+            if not args.keep and not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "spec": spec.to_dict(),
+        "container": dict(info.to_dict(), generate_seconds=round(generate_seconds, 4)),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WeChat Backup 基准测试")
+    parser.add_argument("--accounts", type=int, default=2, help="账号数")
+    parser.add_argument("--chats", type=int, default=20, help="每个账号的会话数")
+    parser.add_argument("--images", type=int, default=30, help="每个会话的图片数")
+    parser.add_argument("--videos", type=int, default=2, help="每个会话的视频数")
+    parser.add_argument("--thumbs", type=int, default=30, help="每个会话的缩略图数")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2, help="重复内容比例")
+    parser.add_argument("--depth", type=int, default=0, help="会话目录下额外嵌套层数")
+    parser.add_argument("--events", type=int, default=200, help="增量事件测试写入的新文件数")
+    parser.add_argument("--db-ops", type=int, default=20000, help="数据库测试的操作次数")
+    parser.add_argument("--copy-workers", type=int, default=4, help="小文件复制线程数")
+    parser.add_argument("--large-copy-workers", type=int, default=2, help="大文件复制线程数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--workdir", help="工作目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
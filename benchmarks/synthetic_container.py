@@ -0,0 +1,186 @@
+"""
+生成模拟 WeChat 容器目录结构的合成数据，用于基准测试。
+
+目录结构示例：
+    <root>/2.0b4.0.9/<账号哈希>/Message/MessageTemp/<会话哈希>/[<嵌套目录>/]Image|Video|Thumb
+    <root>/2.0b4.0.9/<账号哈希>/Avatar/<会话哈希>.jpg
+    <root>/2.0b4.0.9/<账号哈希>/Message/msg_<n>.db   （不需要备份的数据库文件）
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+VERSION_DIR = "2.0b4.0.9"
+
+
+class ContainerSpec:
+    """合成容器的参数"""
+
+    def __init__(self, accounts=2, chats=20, images=30, videos=2, thumbs=30,
+                 duplicate_ratio=0.2, depth=0, image_size=40 * 1024,
+                 video_size=2 * 1024 * 1024, thumb_size=8 * 1024, noise_files=20, seed=42):
+        """
+        :param accounts: 账号数
+        :param chats: 每个账号的会话数
+        :param images: 每个会话的图片数
+        :param videos: 每个会话的视频数
+        :param thumbs: 每个会话的缩略图数
+        :param duplicate_ratio: 媒体文件中内容与其他文件重复（转发）的比例
+        :param depth: 会话目录与 Image/Video/Thumb 之间额外嵌套的目录层数
+        :param image_size: 图片平均字节数
+        :param video_size: 视频平均字节数
+        :param thumb_size: 缩略图平均字节数
+        :param noise_files: 每个账号下不需要备份的数据库/缓存文件数
+        :param seed: 随机种子，保证可复现
+        """
+        self.accounts = accounts
+        self.chats = chats
+        self.images = images
+        self.videos = videos
+        self.thumbs = thumbs
+        self.duplicate_ratio = duplicate_ratio
+        self.depth = depth
+        self.image_size = image_size
+        self.video_size = video_size
+        self.thumb_size = thumb_size
+        self.noise_files = noise_files
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class ContainerInfo:
+    """生成结果的统计信息"""
+
+    def __init__(self, root):
+        self.root = root
+        self.media_files = 0
+        self.media_bytes = 0
+        self.duplicate_files = 0
+        self.noise_files = 0
+        self.avatars = []
+        self.chat_ids = []
+        self.media_dirs = []
+
+    def to_dict(self):
+        return {
+            "media_files": self.media_files,
+            "media_bytes": self.media_bytes,
+            "duplicate_files": self.duplicate_files,
+            "noise_files": self.noise_files,
+            "avatars": len(self.avatars),
+            "chats": len(self.chat_ids),
+        }
+
+
+def _hex_id(rng):
+    return hashlib.md5(rng.getrandbits(64).to_bytes(8, "little")).hexdigest()
+
+
+def _random_bytes(rng, average):
+    size = max(1, int(rng.uniform(0.5, 1.5) * average))
+    return rng.getrandbits(size * 8).to_bytes(size, "little")
+
+
+def _avatar_bytes(rng):
+    if Image is None:
+        return _random_bytes(rng, 4 * 1024)
+    color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    image = Image.new("RGB", (640, 640), color)
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def generate_container(root, spec):
+    """
+    在 root 下生成合成 WeChat 容器。
+    :param root: 输出目录
+    :param spec: ContainerSpec
+    :return: ContainerInfo
+    """
+    rng = random.Random(spec.seed)
+    info = ContainerInfo(root)
+    pool = []  # 已生成的媒体内容，用于制造重复文件
+
+    def write_media(dir_path, name, average):
+        if pool and rng.random() < spec.duplicate_ratio:
+            data = rng.choice(pool)
+            info.duplicate_files += 1
+        else:
+            data = _random_bytes(rng, average)
+            if len(pool) < 256:
+                pool.append(data)
+        with open(os.path.join(dir_path, name), "wb") as f:
+            f.write(data)
+        info.media_files += 1
+        info.media_bytes += len(data)
+
+    for _ in range(spec.accounts):
+        account_dir = os.path.join(root, VERSION_DIR, _hex_id(rng))
+        avatar_dir = os.path.join(account_dir, "Avatar")
+        message_dir = os.path.join(account_dir, "Message")
+        os.makedirs(avatar_dir, exist_ok=True)
+        os.makedirs(message_dir, exist_ok=True)
+
+        for n in range(spec.noise_files):
+            with open(os.path.join(message_dir, f"msg_{n}.db"), "wb") as f:
+                f.write(_random_bytes(rng, 16 * 1024))
+            info.noise_files += 1
+
+        for _ in range(spec.chats):
+            chat_id = _hex_id(rng)
+            info.chat_ids.append(chat_id)
+
+            avatar_path = os.path.join(avatar_dir, f"{chat_id}.jpg")
+            with open(avatar_path, "wb") as f:
+                f.write(_avatar_bytes(rng))
+            info.avatars.append(avatar_path)
+
+            chat_dir = os.path.join(message_dir, "MessageTemp", chat_id)
+            for level in range(spec.depth):
+                chat_dir = os.path.join(chat_dir, f"level{level}")
+
+            for kind, count, average, ext in (("Image", spec.images, spec.image_size, ".jpg"),
+                                              ("Video", spec.videos, spec.video_size, ".mp4"),
+                                              ("Thumb", spec.thumbs, spec.thumb_size, ".jpg")):
+                media_dir = os.path.join(chat_dir, kind)
+                os.makedirs(media_dir, exist_ok=True)
+                info.media_dirs.append(media_dir)
+                for i in range(count):
+                    write_media(media_dir, f"{kind.lower()}_{i}{ext}", average)
+
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成 WeChat 容器目录")
+    parser.add_argument("root", help="输出目录")
+    parser.add_argument("--accounts", type=int, default=2)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--images", type=int, default=30)
+    parser.add_argument("--videos", type=int, default=2)
+    parser.add_argument("--thumbs", type=int, default=30)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2)
+    parser.add_argument("--depth", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    spec = ContainerSpec(accounts=args.accounts, chats=args.chats, images=args.images,
+                         videos=args.videos, thumbs=args.thumbs,
+                         duplicate_ratio=args.duplicate_ratio, depth=args.depth, seed=args.seed)
+    info = generate_container(args.root, spec)
+    print(json.dumps(info.to_dict(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
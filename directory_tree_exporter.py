@@ -1,34 +1,250 @@
+import argparse
+import json
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-def export_directory_tree(base_dir, output_file="directory_tree.txt"):
+DEFAULT_WORKERS = 8
+
+
+class DirectoryNode:
+    """目录树节点：记录本目录直接包含的文件统计，以及自底向上汇总的整棵子树统计"""
+
+    __slots__ = ("path", "name", "depth", "parent", "children", "extensions", "total_extensions",
+                 "pending", "error")
+
+    def __init__(self, path, parent):
+        self.path = path
+        self.name = os.path.basename(path) or path
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.children = []
+        self.extensions = {}  # 扩展名 -> [文件数, 字节数]，仅本目录
+        self.total_extensions = {}  # 扩展名 -> [文件数, 字节数]，含所有子目录
+        self.pending = 0  # 尚未汇总完成的子目录数
+        self.error = None
+
+    def set_files(self, extensions):
+        self.extensions = extensions
+        self.total_extensions = {ext: list(stats) for ext, stats in extensions.items()}
+
+    def add_subtree(self, child):
+        for ext, (count, size) in child.total_extensions.items():
+            stats = self.total_extensions.get(ext)
+            if stats is None:
+                self.total_extensions[ext] = [count, size]
+            else:
+                stats[0] += count
+                stats[1] += size
+
+    @property
+    def files(self):
+        return sum(count for count, _ in self.extensions.values())
+
+    @property
+    def bytes(self):
+        return sum(size for _, size in self.extensions.values())
+
+    @property
+    def total_files(self):
+        return sum(count for count, _ in self.total_extensions.values())
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, size in self.total_extensions.values())
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "depth": self.depth,
+            "files": self.files,
+            "bytes": self.bytes,
+            "total_files": self.total_files,
+            "total_bytes": self.total_bytes,
+            "extensions": {ext: {"files": c, "bytes": b} for ext, (c, b) in sorted(self.extensions.items())},
+            "total_extensions": {
+                ext: {"files": c, "bytes": b} for ext, (c, b) in sorted(self.total_extensions.items())
+            },
+            "error": self.error,
+        }
+
+
+def _scan_directory(dir_path):
+    """
+    读取单个目录。
+    :return: (子目录路径列表, {扩展名: [文件数, 字节数]}, 错误信息)
+    """
+    subdirs = []
+    extensions = {}
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+                ext = os.path.splitext(entry.name)[1]
+                stats = extensions.get(ext)
+                if stats is None:
+                    extensions[ext] = [1, size]
+                else:
+                    stats[0] += 1
+                    stats[1] += size
+    except OSError as e:
+        return subdirs, extensions, str(e)
+    return subdirs, extensions, None
+
+
+def _complete(node, on_complete):
+    """节点及其全部子目录统计完成后向上汇总，父目录随之可能完成"""
+    while node is not None:
+        if on_complete is not None:
+            on_complete(node)
+        parent = node.parent
+        if parent is None:
+            return
+        parent.add_subtree(node)
+        parent.pending -= 1
+        if parent.pending:
+            return
+        node = parent
+
+
+def scan_tree(base_dir, workers=DEFAULT_WORKERS, on_complete=None):
+    """
+    用线程池并行 scandir 遍历目录树并统计各扩展名的文件数和字节数。
+    :param base_dir: 根目录
+    :param workers: 并行读取目录的线程数
+    :param on_complete: 某个目录的整棵子树统计完成时的回调 on_complete(node)，按自底向上的顺序调用
+    :return: 根节点 DirectoryNode
+    """
+    root = DirectoryNode(os.path.abspath(base_dir), None)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {pool.submit(_scan_directory, root.path): root}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                subdirs, extensions, node.error = future.result()
+                node.set_files(extensions)
+                for sub_path in subdirs:
+                    child = DirectoryNode(sub_path, node)
+                    node.children.append(child)
+                    running[pool.submit(_scan_directory, sub_path)] = child
+                node.pending = len(node.children)
+                if not node.pending:
+                    _complete(node, on_complete)
+    return root
+
+
+def load_tree_from_index(base_dir, on_complete=None):
     """
-    导出指定目录的完整目录树结构到 txt 文件，末级目录下输出文件类型计数数据。
-    
+    根据备份清单中记录的源文件构建目录树，不访问磁盘。
+    清单只包含已备份的文件，因此没有可备份文件的目录不会出现。
+    :param base_dir: 根目录
+    :param on_complete: 同 scan_tree
+    :return: 根节点 DirectoryNode
+    """
+    from sync.config_store import list_manifest
+
+    root = DirectoryNode(os.path.abspath(base_dir), None)
+    nodes = {root.path: root}
+
+    def get_node(dir_path):
+        node = nodes.get(dir_path)
+        if node is None:
+            parent = get_node(os.path.dirname(dir_path))
+            node = nodes[dir_path] = DirectoryNode(dir_path, parent)
+            parent.children.append(node)
+        return node
+
+    for file_path, size in list_manifest(root.path):
+        dir_path, name = os.path.split(file_path)
+        node = get_node(dir_path)
+        ext = os.path.splitext(name)[1]
+        stats = node.extensions.setdefault(ext, [0, 0])
+        stats[0] += 1
+        stats[1] += size
+
+    for node in nodes.values():
+        node.set_files(node.extensions)
+        node.pending = len(node.children)
+    for node in [node for node in nodes.values() if not node.children]:
+        _complete(node, on_complete)
+    return root
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+def write_text_node(node, base_path, f):
+    """
+    写出单个目录的文本统计。目录按子树统计完成的顺序（子目录先于父目录）写出，
+    因此用相对根目录的路径标识目录，而不是按层级缩进。
+    :param node: 子树统计已完成的 DirectoryNode
+    :param base_path: 根目录的绝对路径
+    :param f: 输出文件
+    """
+    label = node.path if node.depth == 0 else os.path.relpath(node.path, base_path)
+    f.write(f"{label}/  [{node.total_files} 个文件, {_format_size(node.total_bytes)}]\n")
+    if node.error:
+        f.write(f"    (无法读取: {node.error})\n")
+    for ext, (count, size) in sorted(node.extensions.items()):
+        f.write(f"    {ext or '(无扩展名)'}: {count} ({_format_size(size)})\n")
+
+
+def export_directory_tree(base_dir, output_file="directory_tree.txt", output_format="text",
+                          workers=DEFAULT_WORKERS, from_index=False):
+    """
+    导出指定目录的完整目录树结构，每个目录输出文件类型计数、字节数以及整棵子树的汇总。
+
     :param base_dir: 需要导出目录树的根目录
-    :param output_file: 输出的 txt 文件路径
+    :param output_file: 输出文件路径
+    :param output_format: "text" 为文本，"jsonl" 为每行一个目录的 JSON；
+                          两种格式都在目录的整棵子树统计完成时立即写出，子目录先于父目录，根目录在最后
+    :param workers: 并行读取目录的线程数
+    :param from_index: 为 True 时根据备份清单生成，不扫描磁盘
+    :return: 根节点 DirectoryNode
     """
+    base_path = os.path.abspath(base_dir)
     with open(output_file, "w", encoding="utf-8") as f:
-        for root, dirs, files in os.walk(base_dir):
-            level = root.replace(base_dir, "").count(os.sep)
-            indent = " " * 4 * (level)
-            f.write(f"{indent}{os.path.basename(root)}/\n")
-            
-            # 统计文件类型计数
-            file_type_counts = {}
-            for file in files:
-                _, ext = os.path.splitext(file)
-                file_type_counts[ext] = file_type_counts.get(ext, 0) + 1
-            
-            # 输出文件类型计数
-            subindent = " " * 4 * (level + 1)
-            for ext, count in file_type_counts.items():
-                f.write(f"{subindent}{ext}: {count}\n")
+        if output_format == "jsonl":
+            def on_complete(node):
+                f.write(json.dumps(node.to_dict(), ensure_ascii=False) + "\n")
+        else:
+            def on_complete(node):
+                write_text_node(node, base_path, f)
 
-if __name__ == "__main__":
+        if from_index:
+            return load_tree_from_index(base_dir, on_complete)
+        return scan_tree(base_dir, workers, on_complete)
+
+
+def main():
     home_dir = os.path.expanduser("~")
-    # 指定需要导出目录树的根目录
-    base_dir = os.getenv("WECHAT_DIR", os.path.join(home_dir, "Library/Containers/com.tencent.xinWeChat/Data/Library/Application Support/com.tencent.xinWeChat/"))
+    default_dir = os.getenv("WECHAT_DIR", os.path.join(home_dir, "Library/Containers/com.tencent.xinWeChat/Data/Library/Application Support/com.tencent.xinWeChat/"))
+
+    parser = argparse.ArgumentParser(description="导出目录树及文件类型统计")
+    parser.add_argument("base_dir", nargs="?", default=default_dir, help="需要导出目录树的根目录")
+    parser.add_argument("-o", "--output", help="输出文件路径")
+    parser.add_argument("--format", choices=("text", "jsonl"), default="text", help="输出格式")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="并行读取目录的线程数")
+    parser.add_argument("--from-index", action="store_true", help="根据备份清单生成，不扫描磁盘")
+    args = parser.parse_args()
+
+    output_file = args.output or ("directory_tree.jsonl" if args.format == "jsonl" else "directory_tree.txt")
+    root = export_directory_tree(args.base_dir, output_file, args.format, args.workers, args.from_index)
+    print(f"目录树已成功导出到 {os.path.abspath(output_file)}"
+          f"（{root.total_files} 个文件, {_format_size(root.total_bytes)}）")
 
-    # 导出目录树到 txt 文件
-    export_directory_tree(base_dir)
-    print(f"目录树已成功导出到 {os.path.abspath('directory_tree.txt')}")
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
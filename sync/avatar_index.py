@@ -0,0 +1,135 @@
+import logging
+import os
+
+from .config_store import (
+    add_avatar,
+    get_config,
+    list_avatar_dirs,
+    list_avatars,
+    remove_avatar,
+    remove_avatar_dir,
+    replace_avatar_dir,
+    set_config,
+)
+
+AVATAR_DIR_NAME = "Avatar"
+AVATAR_SUFFIX = ".jpg"
+
+# Avatar 目录位于 <版本>/<账号>/Avatar，搜索时不再深入更深的层级
+AVATAR_SEARCH_DEPTH = 4
+# 体积巨大且不会包含 Avatar 目录的子目录，构建索引时整体跳过
+SKIPPED_DIR_NAMES = frozenset({"Message", "FileStorage"})
+
+
+def is_avatar_path(path):
+    """判断路径是否为 Avatar 目录下的头像文件"""
+    return (path.endswith(AVATAR_SUFFIX)
+            and os.path.basename(os.path.dirname(path)) == AVATAR_DIR_NAME)
+
+
+def find_avatar_dirs(base_wechat_dir):
+    """
+    查找 WeChat 容器中的所有 Avatar 目录。
+    基于 os.scandir 按层遍历，跳过消息目录并限制搜索深度。
+    :param base_wechat_dir: WeChat 容器根目录
+    :return: Avatar 目录路径列表
+    """
+    avatar_dirs = []
+    stack = [(os.path.abspath(base_wechat_dir), 0)]
+    while stack:
+        dir_path, depth = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                    if entry.name == AVATAR_DIR_NAME:
+                        avatar_dirs.append(entry.path)
+                    elif entry.name not in SKIPPED_DIR_NAMES and depth + 1 < AVATAR_SEARCH_DEPTH:
+                        stack.append((entry.path, depth + 1))
+        except OSError as e:
+            logging.warning(f"无法读取目录 {dir_path}: {e}")
+    return sorted(avatar_dirs)
+
+
+def scan_avatar_dir(dir_path):
+    """
+    读取单个 Avatar 目录。
+    :return: (目录修改时间, 头像路径列表)
+    """
+    mtime_ns = os.stat(dir_path).st_mtime_ns
+    with os.scandir(dir_path) as it:
+        paths = [entry.path for entry in it
+                 if entry.name.endswith(AVATAR_SUFFIX) and entry.is_file(follow_symlinks=False)]
+    return mtime_ns, paths
+
+
+def build_avatar_index(base_wechat_dir):
+    """
+    完整构建头像索引，替换之前的全部记录。
+    :param base_wechat_dir: WeChat 容器根目录
+    :return: 头像路径列表
+    """
+    base_wechat_dir = os.path.abspath(base_wechat_dir)
+    found = find_avatar_dirs(base_wechat_dir)
+    for dir_path in set(list_avatar_dirs()) - set(found):
+        remove_avatar_dir(dir_path)
+    for dir_path in found:
+        try:
+            replace_avatar_dir(dir_path, *scan_avatar_dir(dir_path))
+        except OSError as e:
+            logging.warning(f"无法读取头像目录 {dir_path}: {e}")
+    set_config("avatar_index_root", base_wechat_dir)
+    avatars = list_avatars()
+    logging.info(f"头像索引构建完成：{len(found)} 个 Avatar 目录，{len(avatars)} 个头像")
+    return avatars
+
+
+def load_avatar_index(base_wechat_dir):
+    """
+    读取头像索引。索引不存在或属于其他容器时完整构建；
+    否则只检查已知 Avatar 目录的修改时间，重新读取发生变化的目录。
+    :param base_wechat_dir: WeChat 容器根目录
+    :return: 头像路径列表
+    """
+    base_wechat_dir = os.path.abspath(base_wechat_dir)
+    known = list_avatar_dirs()
+    if not known or get_config("avatar_index_root") != base_wechat_dir:
+        return build_avatar_index(base_wechat_dir)
+
+    for dir_path, mtime_ns in known.items():
+        try:
+            current = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            remove_avatar_dir(dir_path)
+            continue
+        except OSError as e:
+            logging.warning(f"无法读取头像目录 {dir_path}: {e}")
+            continue
+        if current != mtime_ns:
+            try:
+                replace_avatar_dir(dir_path, *scan_avatar_dir(dir_path))
+            except OSError as e:
+                logging.warning(f"无法读取头像目录 {dir_path}: {e}")
+    return list_avatars()
+
+
+def record_avatar_created(path, is_directory=False):
+    """文件事件：新增头像或移入整个 Avatar 目录"""
+    if is_directory:
+        if os.path.basename(path) == AVATAR_DIR_NAME:
+            try:
+                replace_avatar_dir(path, *scan_avatar_dir(path))
+            except OSError as e:
+                logging.warning(f"无法读取头像目录 {path}: {e}")
+    elif is_avatar_path(path):
+        add_avatar(path, os.path.dirname(path))
+
+
+def record_avatar_removed(path, is_directory=False):
+    """文件事件：头像或 Avatar 目录被删除"""
+    if is_directory:
+        if os.path.basename(path) == AVATAR_DIR_NAME:
+            remove_avatar_dir(path)
+    elif is_avatar_path(path):
+        remove_avatar(path)
@@ -1,51 +1,71 @@
+import atexit
+import itertools
+import logging
 import os
 import sqlite3
 import threading
-from functools import lru_cache
+import time
 
-# 修改: 定义数据库文件的存储路径
-DB_DIR = os.path.expanduser("~/.wechat_backup")
+from .metrics import DB_WRITE_SECONDS, DB_WRITE_ROWS
+
+# 修改: 定义数据库文件的存储路径，可通过 WECHAT_BACKUP_HOME 覆盖
+DB_DIR = os.getenv("WECHAT_BACKUP_HOME", os.path.expanduser("~/.wechat_backup"))
 DB_PATH = os.path.join(DB_DIR, "wechat_backup.db")
 
 # 确保数据库目录存在
 os.makedirs(DB_DIR, exist_ok=True)
 
+# 待写入的实体文件已被删除
+_REMOVED = object()
+
 
 class Database:
-    def __init__(self):
-        self.local = threading.local()  # 每个线程拥有自己的连接
-        self.ensure_tables_initialized()
-
-    def __enter__(self):
-        if not hasattr(self.local, 'conn'):
-            self.local.conn = sqlite3.connect(DB_PATH)
-            self.local.connected  = True
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if hasattr(self.local, 'conn'):
-            self.local.conn.close()
-            self.local.connected  = False
-
-    def execute(self, query, params=None):
-        if not self.local.conn or not self.local.connected:
-            self.local.conn = sqlite3.connect(DB_PATH)  # 重新建立连接
-        cursor = self.local.conn.cursor()
-        try:
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            self.local.conn.commit()
-            return cursor
-        except Exception as e:
-            self.local.conn.rollback()
-            raise e
+    """
+    持有单个长连接的数据库存储。
+    表结构只在创建实例时初始化一次；哈希类写入先进入内存队列，
+    由后台写线程按批次在一个事务中用 executemany 提交，读取时叠加尚未提交的写入。
+    """
+
+    def __init__(self, db_path=DB_PATH, flush_interval=0.5, batch_size=1000):
+        """
+        :param db_path: 数据库文件路径
+        :param flush_interval: 后台写线程的最长提交间隔（秒）
+        :param batch_size: 队列达到该长度时立即提交
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA cache_size=-16000")  # 约 16 MB 页缓存
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.init_db()
+
+        self.config_cache = {}
+        self.config_version = 0  # 本进程内的配置版本，每次配置变化递增，用于判断派生数据是否需要重建
+        self.stored_config_version = self.read_config_version()  # 上次读取到的数据库中的配置版本
+        self.write_queue = []  # [(sql, params)]，按提交顺序排列
+        self.pending_hashes = {}  # file_path -> hash_value
+        self.pending_blobs = {}  # blob_path -> (size, partial_hash, full_hash, hash_algo) 或 _REMOVED
+        self.pending_manifest = {}  # file_path -> (size, mtime_ns, inode)
+        self.pending_packed = {}  # file_path -> (pack_name, data_offset, size, mtime_ns, full_hash, hash_algo)
+        self.pending_packed_content = {}  # (size, full_hash, hash_algo) -> (pack_name, data_offset)
+
+        self.wakeup = threading.Condition(self.lock)
+        self.closed = False
+        self.writer = threading.Thread(target=self._writer_loop, name="DatabaseWriter", daemon=True)
+        self.writer.start()
 
     def init_db(self):
         """初始化数据库和表结构"""
-        with self as db:
-            db.execute(
+        with self.lock:
+            # 其他进程（例如全量同步的工作进程）可能同时打开数据库，先取得写锁，
+            # 避免读取表结构后再升级为写事务时因快照过期直接失败
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS config (
                     key TEXT PRIMARY KEY,
@@ -53,7 +73,17 @@ class Database:
                 )
                 """
             )
-            db.execute(
+            # 每次修改配置都会递增的持久化版本号，其他进程据此发现配置变化
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS config_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    version INTEGER NOT NULL
+                )
+                """
+            )
+            self.conn.execute("INSERT OR IGNORE INTO config_version (id, version) VALUES (0, 0)")
+            self.conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS file_hashes (
                     file_path TEXT PRIMARY KEY,
@@ -61,103 +91,610 @@ class Database:
                 )
                 """
             )
+            # 旧版本曾以 file_hash 作为列名创建该表
+            columns = self._table_columns("file_hashes")
+            if "hash_value" not in columns and "file_hash" in columns:
+                self.conn.execute("ALTER TABLE file_hashes RENAME COLUMN file_hash TO hash_value")
+            # 每行记录所用的哈希算法，旧记录均为 MD5
+            if "hash_algo" not in columns:
+                self.conn.execute("ALTER TABLE file_hashes ADD COLUMN hash_algo TEXT NOT NULL DEFAULT 'md5'")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    blob_path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    partial_hash TEXT,
+                    full_hash TEXT
+                )
+                """
+            )
+            if "hash_algo" not in self._table_columns("blobs"):
+                self.conn.execute("ALTER TABLE blobs ADD COLUMN hash_algo TEXT NOT NULL DEFAULT 'md5'")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_size ON blobs (size)")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS manifest (
+                    file_path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL
+                )
+                """
+            )
+            # 持久化的待备份文件队列，重启后继续处理未完成的文件
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS work_queue (
+                    src_path TEXT PRIMARY KEY,
+                    state TEXT NOT NULL
+                )
+                """
+            )
+            # 大文件复制进度，中断后从已落盘的位置继续
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS copy_progress (
+                    src_path TEXT PRIMARY KEY,
+                    partial_path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    copied INTEGER NOT NULL
+                )
+                """
+            )
+            # 打包模式下小文件在包文件中的位置，file_path 为相对备份目录的路径
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS packed_files (
+                    file_path TEXT PRIMARY KEY,
+                    pack_name TEXT NOT NULL,
+                    data_offset INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    full_hash TEXT NOT NULL,
+                    hash_algo TEXT NOT NULL
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_packed_content ON packed_files (size, full_hash)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_packed_pack ON packed_files (pack_name)")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS avatar_dirs (
+                    dir_path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS avatars (
+                    avatar_path TEXT PRIMARY KEY,
+                    dir_path TEXT NOT NULL
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_avatars_dir ON avatars (dir_path)")
+            # 上次遍历时各目录的修改时间和条目数，启动时据此只重新扫描发生变化的目录
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS dir_state (
+                    dir_path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    entry_count INTEGER NOT NULL
+                )
+                """
+            )
+            self.conn.execute("COMMIT")
+
+    def _table_columns(self, table):
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+
+    def query(self, sql, params=()):
+        """执行只读查询并返回全部结果"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
 
-    def ensure_tables_initialized(self):
-        """确保数据库表已初始化"""
+    def enqueue(self, sql, params):
+        """将写语句加入批量写入队列"""
+        self.write_queue.append((sql, params))
+        if len(self.write_queue) >= self.batch_size:
+            self.wakeup.notify()
+
+    def flush(self):
+        """立即提交队列中的所有写入"""
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self.write_queue:
+            return
+        queue, self.write_queue = self.write_queue, []
+        start = time.perf_counter()
         try:
-            with self as db:
-                cursor = db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='config'")
-                if not cursor.fetchone():
-                    self.init_db()
-        except sqlite3.OperationalError:
-            self.init_db()
+            self.conn.execute("BEGIN")
+            # 只合并相邻的同类语句，保持不同语句之间的先后顺序
+            for sql, group in itertools.groupby(queue, key=lambda item: item[0]):
+                self.conn.executemany(sql, [params for _, params in group])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            self.write_queue = queue + self.write_queue
+            raise
+        DB_WRITE_SECONDS.observe(time.perf_counter() - start)
+        DB_WRITE_ROWS.inc(len(queue))
+        self.pending_hashes.clear()
+        self.pending_blobs.clear()
+        self.pending_manifest.clear()
+        self.pending_packed.clear()
+        self.pending_packed_content.clear()
+
+    def _writer_loop(self):
+        with self.lock:
+            while not self.closed:
+                self.wakeup.wait(self.flush_interval)
+                try:
+                    self._flush_locked()
+                except sqlite3.Error as e:
+                    logging.error(f"批量写入数据库失败，稍后重试: {e}")
+
+    def close(self):
+        """提交剩余写入并关闭连接"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.wakeup.notify()
+            self._flush_locked()
+        self.writer.join()
+        self.conn.close()
 
     def get_config(self, key, default=None):
         """从数据库中获取配置值"""
-        with self as db:
-            cursor = db.execute("SELECT value FROM config WHERE key = ?", (key,))
-            result = cursor.fetchone()
-            return result[0] if result else default
+        with self.lock:
+            if key not in self.config_cache:
+                rows = self.query("SELECT value FROM config WHERE key = ?", (key,))
+                self.config_cache[key] = rows[0][0] if rows else None
+            value = self.config_cache[key]
+        return value if value is not None else default
 
     def set_config(self, key, value):
-        """在数据库中设置配置值"""
-        with self as db:
-            db.execute(
-                "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
-                (key, value),
-            )
+        """在数据库中设置配置值，并在同一事务中递增持久化的配置版本"""
+        with self.lock:
+            self._flush_locked()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self.read_config_version()
+                self.conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
+                self.conn.execute("UPDATE config_version SET version = version + 1 WHERE id = 0")
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            if previous != self.stored_config_version:
+                # 其他进程在此之前也修改过配置
+                self.config_cache.clear()
+            self.config_cache[key] = value
+            self.config_version += 1
+            self.stored_config_version = previous + 1
+
+    def read_config_version(self):
+        """读取数据库中的持久化配置版本"""
+        rows = self.query("SELECT version FROM config_version WHERE id = 0")
+        return rows[0][0] if rows else 0
+
+    def poll_config(self):
+        """
+        检查其他进程是否修改了配置，有变化时清空配置缓存。
+        只读取一行版本号，适合定期调用。
+        :return: 配置是否发生变化
+        """
+        with self.lock:
+            version = self.read_config_version()
+            if version == self.stored_config_version:
+                return False
+            self.stored_config_version = version
+            self.config_cache.clear()
+            self.config_version += 1
+            return True
 
     def get_file_hash(self, file_path):
         """从数据库中获取文件哈希值"""
-        with self as db:
-            cursor = db.execute("SELECT hash_value FROM file_hashes WHERE file_path = ?", (file_path,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        with self.lock:
+            if file_path in self.pending_hashes:
+                return self.pending_hashes[file_path]
+            rows = self.query("SELECT hash_value FROM file_hashes WHERE file_path = ?", (file_path,))
+            return rows[0][0] if rows else None
+
+    def set_file_hash(self, file_path, hash_value, hash_algo):
+        """在数据库中设置文件哈希值及其算法（批量提交）"""
+        with self.lock:
+            self.pending_hashes[file_path] = hash_value
+            self.enqueue(
+                "INSERT OR REPLACE INTO file_hashes (file_path, hash_value, hash_algo) VALUES (?, ?, ?)",
+                (file_path, hash_value, hash_algo),
+            )
+
+    def find_blobs_by_size(self, size):
+        """
+        按文件大小查找备份目录中已有的实体文件。
+        :return: [(blob_path, partial_hash, full_hash, hash_algo)]
+        """
+        with self.lock:
+            rows = self.query(
+                "SELECT blob_path, partial_hash, full_hash, hash_algo FROM blobs WHERE size = ?", (size,)
+            )
+            if not self.pending_blobs:
+                return rows
+
+            result = []
+            for row in rows:
+                pending = self.pending_blobs.get(row[0])
+                if pending is _REMOVED or (pending is not None and pending[0] not in (None, size)):
+                    continue
+                if pending is not None:
+                    row = (row[0],) + pending[1:]
+                result.append(row)
+
+            known = {row[0] for row in rows}
+            for blob_path, pending in self.pending_blobs.items():
+                if pending is not _REMOVED and pending[0] == size and blob_path not in known:
+                    result.append((blob_path,) + pending[1:])
+            return result
+
+    def add_blob(self, blob_path, size, partial_hash, full_hash, hash_algo):
+        """登记一个备份目录中的实体文件（批量提交）"""
+        with self.lock:
+            self.pending_blobs[blob_path] = (size, partial_hash, full_hash, hash_algo)
+            self.enqueue(
+                "INSERT OR REPLACE INTO blobs (blob_path, size, partial_hash, full_hash, hash_algo) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (blob_path, size, partial_hash, full_hash, hash_algo),
+            )
+
+    def update_blob_hashes(self, blob_path, partial_hash, full_hash, hash_algo):
+        """补充或按新算法重算实体文件的哈希值（批量提交）"""
+        with self.lock:
+            pending = self.pending_blobs.get(blob_path)
+            size = pending[0] if pending is not None and pending is not _REMOVED else None
+            self.pending_blobs[blob_path] = (size, partial_hash, full_hash, hash_algo)
+            self.enqueue(
+                "UPDATE blobs SET partial_hash = ?, full_hash = ?, hash_algo = ? WHERE blob_path = ?",
+                (partial_hash, full_hash, hash_algo, blob_path),
+            )
+
+    def remove_blob(self, blob_path):
+        """移除已不存在的实体文件记录（批量提交）"""
+        with self.lock:
+            self.pending_blobs[blob_path] = _REMOVED
+            self.enqueue("DELETE FROM blobs WHERE blob_path = ?", (blob_path,))
+
+    def get_manifest(self, file_path):
+        """获取源文件上次备份时的 (size, mtime_ns, inode)，未记录时返回 None"""
+        with self.lock:
+            if file_path in self.pending_manifest:
+                return self.pending_manifest[file_path]
+            rows = self.query(
+                "SELECT size, mtime_ns, inode FROM manifest WHERE file_path = ?", (file_path,)
+            )
+            return rows[0] if rows else None
 
-    def set_file_hash(self, file_path, hash_value):
-        """在数据库中设置文件哈希值"""
-        with self as db:
-            db.execute(
-                "INSERT OR REPLACE INTO file_hashes (file_path, hash_value) VALUES (?, ?)",
-                (file_path, hash_value),
+    def set_manifest(self, file_path, size, mtime_ns, inode):
+        """记录源文件备份时的元数据（批量提交）"""
+        with self.lock:
+            self.pending_manifest[file_path] = (size, mtime_ns, inode)
+            self.enqueue(
+                "INSERT OR REPLACE INTO manifest (file_path, size, mtime_ns, inode) VALUES (?, ?, ?, ?)",
+                (file_path, size, mtime_ns, inode),
             )
 
+    def set_work_state(self, src_path, state):
+        """记录待备份文件的处理状态（批量提交）"""
+        with self.lock:
+            self.enqueue("INSERT OR REPLACE INTO work_queue (src_path, state) VALUES (?, ?)", (src_path, state))
+
+    def remove_work(self, src_path):
+        """文件处理完成后移出队列（批量提交）"""
+        with self.lock:
+            self.enqueue("DELETE FROM work_queue WHERE src_path = ?", (src_path,))
+
+    def list_work(self):
+        """返回队列中尚未完成的文件 [(src_path, state)]"""
+        with self.lock:
+            self._flush_locked()
+            return self.query("SELECT src_path, state FROM work_queue ORDER BY src_path")
+
+    def get_copy_progress(self, src_path):
+        """返回 (partial_path, size, mtime_ns, inode, copied)，没有未完成的复制时返回 None"""
+        with self.lock:
+            self._flush_locked()
+            rows = self.query(
+                "SELECT partial_path, size, mtime_ns, inode, copied FROM copy_progress WHERE src_path = ?",
+                (src_path,),
+            )
+            return rows[0] if rows else None
+
+    def set_copy_progress(self, src_path, partial_path, size, mtime_ns, inode, copied):
+        """记录已落盘的复制进度（批量提交，记录落后于实际进度时只会多复制一段）"""
+        with self.lock:
+            self.enqueue(
+                "INSERT OR REPLACE INTO copy_progress (src_path, partial_path, size, mtime_ns, inode, copied) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (src_path, partial_path, size, mtime_ns, inode, copied),
+            )
+
+    def clear_copy_progress(self, src_path):
+        """复制完成后删除进度记录（批量提交）"""
+        with self.lock:
+            self.enqueue("DELETE FROM copy_progress WHERE src_path = ?", (src_path,))
+
+    def find_packed(self, size, full_hash, hash_algo):
+        """按内容查找已打包的文件，返回 (pack_name, data_offset) 或 None"""
+        with self.lock:
+            location = self.pending_packed_content.get((size, full_hash, hash_algo))
+            if location is not None:
+                return location
+            rows = self.query(
+                "SELECT pack_name, data_offset FROM packed_files "
+                "WHERE size = ? AND full_hash = ? AND hash_algo = ? LIMIT 1",
+                (size, full_hash, hash_algo),
+            )
+            return rows[0] if rows else None
+
+    def get_packed(self, file_path):
+        """返回 (pack_name, data_offset, size, mtime_ns)，未打包时返回 None"""
+        with self.lock:
+            pending = self.pending_packed.get(file_path)
+            if pending is not None:
+                return pending[:4]
+            rows = self.query(
+                "SELECT pack_name, data_offset, size, mtime_ns FROM packed_files WHERE file_path = ?", (file_path,)
+            )
+            return rows[0] if rows else None
+
+    def list_packed(self):
+        """返回所有已打包文件 [(file_path, pack_name, data_offset, size, mtime_ns)]"""
+        with self.lock:
+            rows = self.query(
+                "SELECT file_path, pack_name, data_offset, size, mtime_ns FROM packed_files ORDER BY file_path"
+            )
+            if not self.pending_packed:
+                return rows
+            entries = {row[0]: row for row in rows}
+            for file_path, pending in self.pending_packed.items():
+                entries[file_path] = (file_path,) + pending[:4]
+            return [entries[file_path] for file_path in sorted(entries)]
+
+    def packed_end(self, pack_name):
+        """包文件中已登记数据的结束位置"""
+        with self.lock:
+            rows = self.query("SELECT MAX(data_offset + size) FROM packed_files WHERE pack_name = ?", (pack_name,))
+            end = rows[0][0] or 0
+            for pending in self.pending_packed.values():
+                if pending[0] == pack_name:
+                    end = max(end, pending[1] + pending[2])
+            return end
+
+    def add_packed(self, file_path, pack_name, data_offset, size, mtime_ns, full_hash, hash_algo):
+        """登记打包文件的位置（批量提交）"""
+        with self.lock:
+            self.enqueue(
+                "INSERT OR REPLACE INTO packed_files "
+                "(file_path, pack_name, data_offset, size, mtime_ns, full_hash, hash_algo) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_path, pack_name, data_offset, size, mtime_ns, full_hash, hash_algo),
+            )
+            self.pending_packed[file_path] = (pack_name, data_offset, size, mtime_ns, full_hash, hash_algo)
+            self.pending_packed_content[(size, full_hash, hash_algo)] = (pack_name, data_offset)
+
+    def list_manifest(self, prefix):
+        """
+        列出清单中位于 prefix 目录下的所有源文件。
+        :param prefix: 目录路径
+        :return: [(file_path, size)]，按路径排序
+        """
+        prefix = prefix.rstrip(os.sep) + os.sep
+        # 以分隔符的下一个字符作为上界，范围查询可以直接利用主键索引
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        with self.lock:
+            self._flush_locked()
+            return self.query(
+                "SELECT file_path, size FROM manifest WHERE file_path >= ? AND file_path < ? ORDER BY file_path",
+                (prefix, upper),
+            )
+
+    def list_dir_states(self, root):
+        """
+        列出 root 及其下所有已记录的目录状态。
+        :param root: 目录路径
+        :return: {dir_path: (mtime_ns, entry_count)}
+        """
+        root = root.rstrip(os.sep) or os.sep
+        prefix = root.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        with self.lock:
+            self._flush_locked()
+            rows = self.query(
+                "SELECT dir_path, mtime_ns, entry_count FROM dir_state "
+                "WHERE dir_path = ? OR (dir_path >= ? AND dir_path < ?)",
+                (root, prefix, upper),
+            )
+        return {dir_path: (mtime_ns, entry_count) for dir_path, mtime_ns, entry_count in rows}
+
+    def set_dir_state(self, dir_path, mtime_ns, entry_count):
+        """记录目录扫描时的状态（批量提交，排在同一次遍历登记的文件之后）"""
+        with self.lock:
+            self.enqueue(
+                "INSERT OR REPLACE INTO dir_state (dir_path, mtime_ns, entry_count) VALUES (?, ?, ?)",
+                (dir_path, mtime_ns, entry_count),
+            )
+
+    def remove_dir_states(self, dir_path):
+        """移除已不存在的目录及其所有子目录的状态（批量提交）"""
+        prefix = dir_path.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        with self.lock:
+            self.enqueue(
+                "DELETE FROM dir_state WHERE dir_path = ? OR (dir_path >= ? AND dir_path < ?)",
+                (dir_path, prefix, upper),
+            )
+
+    def list_avatars(self):
+        """返回头像索引中的全部头像路径（已排序）"""
+        with self.lock:
+            self._flush_locked()
+            return [row[0] for row in self.query("SELECT avatar_path FROM avatars ORDER BY avatar_path")]
+
+    def list_avatar_dirs(self):
+        """返回已索引的 Avatar 目录及其扫描时的修改时间 {dir_path: mtime_ns}"""
+        with self.lock:
+            self._flush_locked()
+            return dict(self.query("SELECT dir_path, mtime_ns FROM avatar_dirs"))
+
+    def replace_avatar_dir(self, dir_path, mtime_ns, avatar_paths):
+        """用一次扫描结果整体替换某个 Avatar 目录的索引"""
+        with self.lock:
+            self._flush_locked()
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM avatars WHERE dir_path = ?", (dir_path,))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO avatars (avatar_path, dir_path) VALUES (?, ?)",
+                    [(path, dir_path) for path in avatar_paths],
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO avatar_dirs (dir_path, mtime_ns) VALUES (?, ?)", (dir_path, mtime_ns)
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def remove_avatar_dir(self, dir_path):
+        """移除已不存在的 Avatar 目录及其下的头像记录（批量提交）"""
+        with self.lock:
+            self.enqueue("DELETE FROM avatars WHERE dir_path = ?", (dir_path,))
+            self.enqueue("DELETE FROM avatar_dirs WHERE dir_path = ?", (dir_path,))
+
+    def add_avatar(self, avatar_path, dir_path):
+        """登记一个新出现的头像文件（批量提交）"""
+        with self.lock:
+            self.enqueue(
+                "INSERT OR REPLACE INTO avatars (avatar_path, dir_path) VALUES (?, ?)", (avatar_path, dir_path)
+            )
+
+    def remove_avatar(self, avatar_path):
+        """移除已删除的头像文件记录（批量提交）"""
+        with self.lock:
+            self.enqueue("DELETE FROM avatars WHERE avatar_path = ?", (avatar_path,))
+
+
 # 创建全局数据库实例
 db = Database()
+atexit.register(db.close)
+
 
-# 提供与原函数相同的接口
 def get_config(key, default=None):
-    """从数据库中获取配置值"""
-    with db as db_instance:  # 使用全局 db 实例
-        cursor = db_instance.execute("SELECT value FROM config WHERE key = ?", (key,))
-        result = cursor.fetchone()
-        return result[0] if result else default
+    return db.get_config(key, default)
 
 def set_config(key, value):
-    """在数据库中设置配置值"""
-    with db as db_instance:  # 使用全局 db 实例
-        db_instance.execute(
-            "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
-            (key, value),
-        )
-
-@lru_cache(maxsize=None)
-def get_config(key, default_value):
-    """从数据库中获取配置值"""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
-        cursor.execute("SELECT value FROM config WHERE key = ?", (key,))
-        result = cursor.fetchone()
-        return result[0] if result else default_value
+    db.set_config(key, value)
 
-def set_config(key, value):
-    """将配置值保存到数据库中"""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
-        cursor.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
-        conn.commit()
+def get_config_version():
+    """返回配置版本号，配置变化后版本号会改变"""
+    return db.config_version
 
-def get_file_hash(file_path):
-    """从数据库中获取文件的 MD5 哈希值"""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS file_hashes (file_path TEXT PRIMARY KEY, file_hash TEXT)")
-        cursor.execute("SELECT file_hash FROM file_hashes WHERE file_path = ?", (file_path,))
-        result = cursor.fetchone()
-        return result[0] if result else None
-
-def set_file_hash(file_path, file_hash):
-    """将文件的 MD5 哈希值保存到数据库中"""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS file_hashes (file_path TEXT PRIMARY KEY, file_hash TEXT)")
-        cursor.execute("INSERT OR REPLACE INTO file_hashes (file_path, file_hash) VALUES (?, ?)", (file_path, file_hash))
-        conn.commit()
+def poll_config():
+    """检查其他进程写入的配置变化，返回是否有变化"""
+    return db.poll_config()
 
 def get_file_hash(file_path):
     return db.get_file_hash(file_path)
 
-def set_file_hash(file_path, hash_value):
-    db.set_file_hash(file_path, hash_value)
\ No newline at end of file
+def set_file_hash(file_path, hash_value, hash_algo):
+    db.set_file_hash(file_path, hash_value, hash_algo)
+
+def find_blobs_by_size(size):
+    return db.find_blobs_by_size(size)
+
+def add_blob(blob_path, size, partial_hash, full_hash, hash_algo):
+    db.add_blob(blob_path, size, partial_hash, full_hash, hash_algo)
+
+def update_blob_hashes(blob_path, partial_hash, full_hash, hash_algo):
+    db.update_blob_hashes(blob_path, partial_hash, full_hash, hash_algo)
+
+def remove_blob(blob_path):
+    db.remove_blob(blob_path)
+
+def get_manifest(file_path):
+    return db.get_manifest(file_path)
+
+def set_manifest(file_path, size, mtime_ns, inode):
+    db.set_manifest(file_path, size, mtime_ns, inode)
+
+def set_work_state(src_path, state):
+    db.set_work_state(src_path, state)
+
+def remove_work(src_path):
+    db.remove_work(src_path)
+
+def list_work():
+    return db.list_work()
+
+def get_copy_progress(src_path):
+    return db.get_copy_progress(src_path)
+
+def set_copy_progress(src_path, partial_path, size, mtime_ns, inode, copied):
+    db.set_copy_progress(src_path, partial_path, size, mtime_ns, inode, copied)
+
+def clear_copy_progress(src_path):
+    db.clear_copy_progress(src_path)
+
+def find_packed(size, full_hash, hash_algo):
+    return db.find_packed(size, full_hash, hash_algo)
+
+def get_packed(file_path):
+    return db.get_packed(file_path)
+
+def list_packed():
+    return db.list_packed()
+
+def packed_end(pack_name):
+    return db.packed_end(pack_name)
+
+def add_packed(file_path, pack_name, data_offset, size, mtime_ns, full_hash, hash_algo):
+    db.add_packed(file_path, pack_name, data_offset, size, mtime_ns, full_hash, hash_algo)
+
+def list_manifest(prefix):
+    return db.list_manifest(prefix)
+
+def list_dir_states(root):
+    return db.list_dir_states(root)
+
+def set_dir_state(dir_path, mtime_ns, entry_count):
+    db.set_dir_state(dir_path, mtime_ns, entry_count)
+
+def remove_dir_states(dir_path):
+    db.remove_dir_states(dir_path)
+
+def list_avatars():
+    return db.list_avatars()
+
+def list_avatar_dirs():
+    return db.list_avatar_dirs()
+
+def replace_avatar_dir(dir_path, mtime_ns, avatar_paths):
+    db.replace_avatar_dir(dir_path, mtime_ns, avatar_paths)
+
+def remove_avatar_dir(dir_path):
+    db.remove_avatar_dir(dir_path)
+
+def add_avatar(avatar_path, dir_path):
+    db.add_avatar(avatar_path, dir_path)
+
+def remove_avatar(avatar_path):
+    db.remove_avatar(avatar_path)
+
+def flush():
+    """立即提交所有尚未写入的记录"""
+    db.flush()
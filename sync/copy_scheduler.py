@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+from queue import Queue
+
+from .config_store import get_config
+from .file_copy import large_file_threshold
+
+# 停止工作线程的哨兵
+_STOP = object()
+
+
+class CopyScheduler:
+    """
+    按文件大小分道的并发备份调度器。
+    小文件和大文件各有独立的有界队列和工作线程，小文件不会排在大视频后面；
+    队列满时 submit 会阻塞，从而对目录遍历和事件处理形成背压。
+    """
+
+    def __init__(self, handle_file, small_workers=4, large_workers=2,
+                 large_threshold=8 * 1024 * 1024, queue_size=256):
+        """
+        :param handle_file: 备份单个文件的函数，参数为源文件路径、stat 信息以及 submit 传入的其他关键字参数
+        :param small_workers: 小文件通道的工作线程数
+        :param large_workers: 大文件通道的工作线程数
+        :param large_threshold: 大于等于该字节数的文件进入大文件通道
+        :param queue_size: 小文件队列容量，大文件队列容量为工作线程数的两倍
+        """
+        self.handle_file = handle_file
+        self.large_threshold = large_threshold
+        self.small_queue = Queue(maxsize=queue_size)
+        self.large_queue = Queue(maxsize=max(large_workers * 2, 1))
+        self.threads = []
+
+        for lane, queue, count in (("small", self.small_queue, small_workers),
+                                   ("large", self.large_queue, large_workers)):
+            for i in range(max(count, 1)):
+                thread = threading.Thread(
+                    target=self._worker, args=(queue,), name=f"Copy-{lane}-{i}", daemon=True
+                )
+                thread.start()
+                self.threads.append((queue, thread))
+
+    @classmethod
+    def from_config(cls, handle_file):
+        """根据数据库中的配置创建调度器"""
+        return cls(
+            handle_file,
+            small_workers=int(get_config("copy_workers", "4")),
+            large_workers=int(get_config("large_copy_workers", "2")),
+            large_threshold=large_file_threshold(),
+            queue_size=int(get_config("copy_queue_size", "256")),
+        )
+
+    def submit(self, src_path, st=None, **kwargs):
+        """
+        提交一个待备份文件，对应通道的队列已满时阻塞。
+        :param src_path: 源文件路径
+        :param st: 已获取的 stat 信息，未提供时调用 stat 获取
+        :param kwargs: 原样传给 handle_file 的其他参数
+        """
+        if st is None:
+            try:
+                st = os.stat(src_path)
+            except OSError:
+                return
+        queue = self.large_queue if st.st_size >= self.large_threshold else self.small_queue
+        queue.put((src_path, st, kwargs))
+
+    def queue_depth(self):
+        """两个通道中等待处理的文件数"""
+        return self.small_queue.qsize() + self.large_queue.qsize()
+
+    def join(self):
+        """等待所有已提交的文件处理完毕"""
+        self.small_queue.join()
+        self.large_queue.join()
+
+    def shutdown(self):
+        """处理完已提交的文件后停止所有工作线程"""
+        for queue, _ in self.threads:
+            queue.put(_STOP)
+        for _, thread in self.threads:
+            thread.join()
+
+    def _worker(self, queue):
+        while True:
+            task = queue.get()
+            try:
+                if task is _STOP:
+                    return
+                src_path, st, kwargs = task
+                self.handle_file(src_path, st, **kwargs)
+            except Exception as e:
+                logging.error(f"备份文件 {src_path} 时出错: {e}", exc_info=True)
+            finally:
+                queue.task_done()
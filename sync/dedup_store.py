@@ -0,0 +1,186 @@
+import os
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+
+from .config_store import find_blobs_by_size, add_blob, update_blob_hashes, remove_blob
+from .hashing import current_algorithm, new_hasher, hash_file, get_hash_pool
+from .metrics import HASH_SECONDS
+
+# 部分哈希读取文件头尾各 64 KB
+PARTIAL_CHUNK_SIZE = 64 * 1024
+
+# Linux FICLONE ioctl 编号
+FICLONE = 0x40049409
+
+
+def get_partial_hash(file_path, size, algorithm):
+    """
+    计算文件头尾两段内容的哈希值，用于在完整哈希之前快速排除不同文件。
+    :param file_path: 文件路径
+    :param size: 文件大小
+    :param algorithm: 哈希算法名称
+    :return: 部分哈希值
+    """
+    hasher = new_hasher(algorithm)
+    with open(file_path, "rb") as f:
+        hasher.update(f.read(PARTIAL_CHUNK_SIZE))
+        if size > PARTIAL_CHUNK_SIZE * 2:
+            f.seek(size - PARTIAL_CHUNK_SIZE)
+            hasher.update(f.read(PARTIAL_CHUNK_SIZE))
+        elif size > PARTIAL_CHUNK_SIZE:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def reflink(src_path, target_path):
+    """
+    尝试以写时复制（reflink / clonefile）的方式复制文件。
+    :return: 是否成功
+    """
+    if sys.platform == "darwin":
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "clonefile"):
+            return False
+        return libc.clonefile(os.fsencode(src_path), os.fsencode(target_path), 0) == 0
+
+    if sys.platform.startswith("linux"):
+        import fcntl
+        try:
+            with open(src_path, "rb") as src, open(target_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            return False
+
+    return False
+
+
+def materialize(blob_path, target_path):
+    """
+    在目标位置生成已有实体文件的副本，依次尝试 reflink、硬链接和普通复制。
+    先写入临时路径再替换，避免截断与其他路径共享 inode 的旧目标文件。
+    :param blob_path: 已备份的实体文件
+    :param target_path: 新的备份路径
+    :return: 实际使用的方式：'reflink'、'hardlink' 或 'copy'
+    """
+    tmp_path = f"{target_path}.dedup-tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    if reflink(blob_path, tmp_path):
+        method = "reflink"
+    else:
+        try:
+            os.link(blob_path, tmp_path)
+            method = "hardlink"
+        except OSError:
+            shutil.copy2(blob_path, tmp_path)
+            method = "copy"
+
+    os.replace(tmp_path, target_path)
+    return method
+
+
+class DedupStore:
+    """
+    基于内容的去重索引：哈希 -> 备份目录中的实体文件。
+    先按文件大小预筛，再比较头尾部分哈希，最后才计算完整哈希，
+    实体文件的哈希值在第一次需要比较时才计算并回写数据库。
+    每条记录保存所用的哈希算法，算法不同的旧记录在比较时按当前算法重算。
+    """
+
+    def __init__(self):
+        self.size_locks = {}  # size -> [Lock, 引用计数]
+        self.guard = threading.Lock()
+
+    @contextmanager
+    def size_lock(self, size):
+        """
+        串行化相同大小文件的查重和登记，避免并发复制同一内容的多个副本。
+        不同大小的文件互不阻塞。
+        """
+        with self.guard:
+            entry = self.size_locks.setdefault(size, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.size_locks[size]
+
+    def find_duplicate(self, src_path, size, hashes=None):
+        """
+        查找与源文件内容相同的实体文件。
+        :param src_path: 源文件路径
+        :param size: 源文件大小
+        :param hashes: 已预先计算的 (哈希算法, 部分哈希, 完整哈希)，算法与当前算法一致时直接使用
+        :return: (实体文件路径或 None, 源文件部分哈希, 源文件完整哈希, 哈希算法)，未计算的哈希为 None
+        """
+        algorithm = current_algorithm()
+        src_partial = src_full = None
+        if hashes is not None and hashes[0] == algorithm:
+            src_partial, src_full = hashes[1], hashes[2]
+
+        candidates = find_blobs_by_size(size)
+        if not candidates:
+            return None, src_partial, src_full, algorithm
+
+        with HASH_SECONDS.time():
+            return self._compare_candidates(src_path, size, algorithm, candidates, src_partial, src_full)
+
+    def _compare_candidates(self, src_path, size, algorithm, candidates, src_partial=None, src_full=None):
+        if src_partial is None:
+            src_partial = get_partial_hash(src_path, size, algorithm)
+        for blob_path, blob_partial, blob_full, blob_algo in candidates:
+            if not os.path.exists(blob_path):
+                remove_blob(blob_path)
+                continue
+
+            if blob_algo != algorithm:
+                blob_partial = blob_full = None
+            if blob_partial is None:
+                blob_partial = get_partial_hash(blob_path, size, algorithm)
+                update_blob_hashes(blob_path, blob_partial, blob_full, algorithm)
+            if blob_partial != src_partial:
+                continue
+
+            if blob_full is None and src_full is None:
+                # 两个完整哈希都需要计算时并行读取
+                pool = get_hash_pool()
+                blob_future = pool.submit(blob_path, algorithm, use_mmap=True)
+                src_full = pool.submit(src_path, algorithm).result()
+                blob_full = blob_future.result()
+                update_blob_hashes(blob_path, blob_partial, blob_full, algorithm)
+            elif blob_full is None:
+                blob_full = hash_file(blob_path, algorithm, use_mmap=True)
+                update_blob_hashes(blob_path, blob_partial, blob_full, algorithm)
+            elif src_full is None:
+                src_full = hash_file(src_path, algorithm)
+            if blob_full == src_full:
+                return blob_path, src_partial, src_full, algorithm
+
+        return None, src_partial, src_full, algorithm
+
+    def link(self, blob_path, target_path):
+        """
+        将目标路径指向已有实体文件。
+        :return: 实际使用的方式，目标已是该实体文件时返回 'existing'
+        """
+        if blob_path == target_path:
+            return "existing"
+        # 目标路径原先登记的实体文件即将被替换
+        remove_blob(target_path)
+        return materialize(blob_path, target_path)
+
+    def record(self, blob_path, size, partial_hash, full_hash, hash_algo):
+        """登记新复制的实体文件"""
+        add_blob(blob_path, size, partial_hash, full_hash, hash_algo)
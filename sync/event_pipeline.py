@@ -0,0 +1,134 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+
+class EventPipeline:
+    """
+    按文件粒度处理文件系统事件。
+    同一路径在去抖窗口内的 created/modified/moved 事件会被合并为一次处理，
+    并且只有在文件大小和修改时间连续稳定后才交给 handle_file 备份。
+    """
+
+    def __init__(self, handle_file, debounce_seconds=1.0, settle_seconds=0.5, stable_checks=2):
+        """
+        :param handle_file: 处理单个文件的回调，参数为文件路径
+        :param debounce_seconds: 最后一次事件之后等待的时间（秒）
+        :param settle_seconds: 文件仍在写入时两次检查之间的间隔（秒）
+        :param stable_checks: 连续多少次 stat 结果不变才认为文件写入完成
+        """
+        self.handle_file = handle_file
+        self.debounce_seconds = debounce_seconds
+        self.settle_seconds = settle_seconds
+        self.stable_checks = stable_checks
+
+        self.pending = {}  # path -> [deadline, last_signature, stable_count]
+        self.heap = []  # (deadline, seq, path)，过期条目在弹出时丢弃
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+
+        self.thread = threading.Thread(target=self._run, name="EventPipeline", daemon=True)
+        self.thread.start()
+
+    def submit(self, path):
+        """登记一个文件事件；窗口内重复的事件只会推迟处理时间"""
+        deadline = time.monotonic() + self.debounce_seconds
+        with self.cond:
+            state = self.pending.get(path)
+            if state is None:
+                self.pending[path] = [deadline, None, 0]
+            else:
+                state[0] = deadline
+                state[2] = 0
+            heapq.heappush(self.heap, (deadline, next(self.seq), path))
+            self.cond.notify()
+
+    def discard(self, path):
+        """取消尚未处理的路径（例如临时文件已被重命名）"""
+        with self.cond:
+            self.pending.pop(path, None)
+
+    def pending_count(self):
+        """当前等待处理的文件数"""
+        with self.cond:
+            return len(self.pending)
+
+    def stop(self, drain=False):
+        """
+        停止后台线程。
+        :param drain: 是否在停止前立即处理所有尚未处理的文件
+        """
+        with self.cond:
+            self.running = False
+            remaining = list(self.pending) if drain else []
+            self.pending.clear()
+            self.cond.notify()
+        self.thread.join()
+        for path in remaining:
+            self._dispatch(path)
+
+    def _pop_due(self):
+        """等待并返回下一个到期的路径，停止时返回 None"""
+        with self.cond:
+            while self.running:
+                now = time.monotonic()
+                while self.heap:
+                    deadline, _, path = self.heap[0]
+                    state = self.pending.get(path)
+                    if state is None or state[0] != deadline:
+                        heapq.heappop(self.heap)
+                        continue
+                    if deadline <= now:
+                        heapq.heappop(self.heap)
+                        return path
+                    break
+                timeout = self.heap[0][0] - now if self.heap else None
+                self.cond.wait(timeout)
+            return None
+
+    def _check_stable(self, path):
+        """
+        检查文件是否已经停止增长。
+        :return: True 表示可以备份，False 表示已重新排期或已放弃
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self.cond:
+                self.pending.pop(path, None)
+            return False
+
+        signature = (st.st_size, st.st_mtime_ns)
+        with self.cond:
+            state = self.pending.get(path)
+            if state is None:
+                return False
+            if state[1] == signature:
+                state[2] += 1
+            else:
+                state[1] = signature
+                state[2] = 1
+            if state[2] >= self.stable_checks:
+                del self.pending[path]
+                return True
+            state[0] = time.monotonic() + self.settle_seconds
+            heapq.heappush(self.heap, (state[0], next(self.seq), path))
+            return False
+
+    def _dispatch(self, path):
+        try:
+            self.handle_file(path)
+        except Exception as e:
+            logging.error(f"处理文件事件 {path} 时出错: {e}", exc_info=True)
+
+    def _run(self):
+        while True:
+            path = self._pop_due()
+            if path is None:
+                return
+            if self._check_stable(path):
+                self._dispatch(path)
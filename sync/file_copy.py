@@ -0,0 +1,186 @@
+import errno
+import logging
+import os
+import shutil
+import sys
+import threading
+
+from .config_store import clear_copy_progress, get_config, get_copy_progress, set_copy_progress
+
+# 复制缓冲区大小
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# 大文件每复制这么多字节落盘一次并记录进度
+CHECKPOINT_SIZE = 64 * 1024 * 1024
+
+# 续传前比对的已复制数据尾部长度
+VERIFY_TAIL_SIZE = 64 * 1024
+
+PARTIAL_SUFFIX = ".partial"
+
+DEFAULT_LARGE_FILE_THRESHOLD = 8 * 1024 * 1024
+
+# 内核不支持时返回这些错误，之后改用其他方式
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+_zero_copy = {"copy_file_range": hasattr(os, "copy_file_range"),
+              "sendfile": sys.platform.startswith("linux") and hasattr(os, "sendfile")}
+
+# 每个工作线程复用自己的缓冲区
+_buffers = threading.local()
+
+
+def large_file_threshold():
+    """大于等于该字节数的文件按大文件处理：单独的复制通道、零拷贝和断点续传"""
+    return int(get_config("large_file_threshold", str(DEFAULT_LARGE_FILE_THRESHOLD)))
+
+
+def _get_buffer():
+    buf = getattr(_buffers, "view", None)
+    if buf is None:
+        buf = memoryview(bytearray(COPY_BUFFER_SIZE))
+        _buffers.view = buf
+    return buf
+
+
+def copy_with_hash(src_path, target_path, hasher=None):
+    """
+    单次读取完成复制和哈希计算：哈希值基于写入目标文件的同一批缓冲区。
+    复制完成后同步文件时间等元数据，与 shutil.copy2 一致。
+    :param src_path: 源文件路径
+    :param target_path: 目标文件路径
+    :param hasher: hashlib 风格的哈希对象，为 None 时只复制
+    :return: 哈希值的十六进制字符串，未提供 hasher 时返回 None
+    """
+    view = _get_buffer()
+    try:
+        with open(src_path, "rb", buffering=0) as src, open(target_path, "wb", buffering=0) as dst:
+            while True:
+                n = src.readinto(view)
+                if not n:
+                    break
+                chunk = view[:n]
+                if hasher is not None:
+                    hasher.update(chunk)
+                written = 0
+                while written < n:
+                    written += dst.write(chunk[written:])
+        shutil.copystat(src_path, target_path)
+    except BaseException:
+        if os.path.lexists(target_path):
+            os.remove(target_path)
+        raise
+    return hasher.hexdigest() if hasher is not None else None
+
+
+def _copy_range(src_fd, dst_fd, offset, count):
+    """
+    在两个文件描述符之间复制 [offset, offset + count) 的数据，目标位置与源位置相同。
+    依次尝试 copy_file_range、sendfile，内核不支持时退回 pread/pwrite。
+    :return: 实际复制的字节数，0 表示源文件已到末尾
+    """
+    if _zero_copy["copy_file_range"]:
+        try:
+            return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            _zero_copy["copy_file_range"] = False
+
+    if _zero_copy["sendfile"]:
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            return os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            _zero_copy["sendfile"] = False
+
+    data = os.pread(src_fd, min(count, COPY_BUFFER_SIZE), offset)
+    written = 0
+    while written < len(data):
+        written += os.pwrite(dst_fd, data[written:], offset + written)
+    return len(data)
+
+
+def _resume_offset(src_fd, partial_path, progress, st):
+    """
+    判断能否从上次记录的进度继续：源文件未变化、临时文件存在，且已复制部分的末尾与源文件一致。
+    :return: 可以继续的位置，不能续传时返回 0
+    """
+    if progress is None:
+        return 0
+    recorded_partial, size, mtime_ns, inode, copied = progress
+    if (recorded_partial != partial_path or (size, mtime_ns, inode) != (st.st_size, st.st_mtime_ns, st.st_ino)
+            or not os.path.exists(partial_path) or os.path.getsize(partial_path) < copied):
+        return 0
+    start = max(copied - VERIFY_TAIL_SIZE, 0)
+    with open(partial_path, "rb") as f:
+        f.seek(start)
+        tail = f.read(copied - start)
+    if tail != os.pread(src_fd, copied - start, start):
+        return 0
+    return copied
+
+
+def copy_large_file(src_path, target_path, st):
+    """
+    大文件复制：通过 copy_file_range / sendfile 在内核中复制数据，写入 .partial 临时文件，
+    每完成 CHECKPOINT_SIZE 字节落盘并记录进度，完成后原子替换目标文件。
+    进程中断后再次复制同一源文件时，从最后一次落盘且校验一致的位置继续。
+    :param src_path: 源文件路径
+    :param target_path: 目标文件路径
+    :param st: 源文件的 stat 信息
+    :return: 本次实际复制的字节数
+    """
+    partial_path = target_path + PARTIAL_SUFFIX
+    with open(src_path, "rb") as src:
+        src_fd = src.fileno()
+        offset = _resume_offset(src_fd, partial_path, get_copy_progress(src_path), st)
+        if offset:
+            logging.info(f"继续复制 {src_path}，从 {offset} / {st.st_size} 字节处开始")
+
+        flags = os.O_WRONLY | os.O_CREAT | (0 if offset else os.O_TRUNC)
+        dst_fd = os.open(partial_path, flags, 0o644)
+        try:
+            os.ftruncate(dst_fd, offset)
+            resumed = offset
+            checkpoint = offset + CHECKPOINT_SIZE
+            while offset < st.st_size:
+                n = _copy_range(src_fd, dst_fd, offset, min(checkpoint, st.st_size) - offset)
+                if not n:
+                    break
+                offset += n
+                if offset >= checkpoint and offset < st.st_size:
+                    os.fsync(dst_fd)
+                    set_copy_progress(src_path, partial_path, st.st_size, st.st_mtime_ns, st.st_ino, offset)
+                    checkpoint = offset + CHECKPOINT_SIZE
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+
+    if offset != st.st_size:
+        raise OSError(f"复制 {src_path} 时源文件大小发生变化")
+    shutil.copystat(src_path, partial_path)
+    os.replace(partial_path, target_path)
+    clear_copy_progress(src_path)
+    return offset - resumed
+
+
+def discard_partial(src_path, target_path):
+    """
+    源文件已不存在或不再需要备份时，删除未完成复制留下的 .partial 临时文件及其复制进度。
+    :param src_path: 源文件路径
+    :param target_path: 目标文件路径
+    """
+    progress = get_copy_progress(src_path)
+    partial_paths = {target_path + PARTIAL_SUFFIX}
+    if progress is not None:
+        partial_paths.add(progress[0])
+        clear_copy_progress(src_path)
+    for partial_path in partial_paths:
+        try:
+            os.remove(partial_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"无法删除临时文件 {partial_path}: {e}")
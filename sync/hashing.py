@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .config_store import get_config
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+DEFAULT_ALGORITHM = "blake2b"
+
+# 不小于该大小的备份端文件通过 mmap 一次性交给哈希函数
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+# 普通读取时的缓冲区大小
+READ_BUFFER_SIZE = 1024 * 1024
+
+ALGORITHMS = {
+    "blake2b": lambda: hashlib.blake2b(digest_size=32),
+    "md5": hashlib.md5,
+    "sha256": hashlib.sha256,
+}
+if xxhash is not None:
+    ALGORITHMS["xxh3_128"] = xxhash.xxh3_128
+if blake3 is not None:
+    ALGORITHMS["blake3"] = lambda: blake3.blake3(max_threads=1)
+
+_buffers = threading.local()
+_unavailable_warned = set()  # 已提示过不可用的算法名称
+
+
+def available_algorithms():
+    """返回当前环境可用的哈希算法名称"""
+    return sorted(ALGORITHMS)
+
+
+def current_algorithm():
+    """
+    读取配置中的哈希算法，算法名称无效或未安装对应的可选依赖时回退到默认算法，并提示一次。
+    :return: 算法名称
+    """
+    name = get_config("hash_algorithm", DEFAULT_ALGORITHM)
+    if name in ALGORITHMS:
+        return name
+    if name not in _unavailable_warned:
+        _unavailable_warned.add(name)
+        logging.warning(f"哈希算法 {name} 不可用（可用的算法: {', '.join(available_algorithms())}），"
+                        f"改用 {DEFAULT_ALGORITHM}")
+    return DEFAULT_ALGORITHM
+
+
+def new_hasher(algorithm=None):
+    """
+    创建哈希对象。
+    :param algorithm: 算法名称，为 None 时使用配置中的算法
+    """
+    return ALGORITHMS[algorithm or current_algorithm()]()
+
+
+def _get_buffer():
+    buf = getattr(_buffers, "view", None)
+    if buf is None:
+        buf = memoryview(bytearray(READ_BUFFER_SIZE))
+        _buffers.view = buf
+    return buf
+
+
+def hash_file(file_path, algorithm=None, use_mmap=False):
+    """
+    计算文件的完整哈希值，复用线程内的大缓冲区读取。
+    映射期间文件被截断会使进程收到 SIGBUS 直接退出，因此只有备份目录中不会被其他程序改写的文件
+    才可以指定 use_mmap；WeChat 的源文件必须按缓冲区读取。
+    :param file_path: 文件路径
+    :param algorithm: 算法名称，为 None 时使用配置中的算法
+    :param use_mmap: 为 True 时大文件使用 mmap
+    :return: 哈希值的十六进制字符串
+    """
+    hasher = new_hasher(algorithm)
+    with open(file_path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if use_mmap and size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                hasher.update(m)
+        else:
+            view = _get_buffer()
+            while True:
+                n = f.readinto(view)
+                if not n:
+                    break
+                hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+class HashPool:
+    """
+    并行计算文件哈希的线程池。hashlib 在处理大块数据时会释放 GIL，
+    因此多个线程可以同时占用多个 CPU 核心。
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        :param max_workers: 线程数，默认取配置 hash_workers 或 CPU 核数
+        """
+        if max_workers is None:
+            max_workers = int(get_config("hash_workers", str(os.cpu_count() or 4)))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Hash")
+
+    def submit(self, file_path, algorithm=None, use_mmap=False):
+        """提交单个文件，返回 Future"""
+        return self.executor.submit(hash_file, file_path, algorithm, use_mmap)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hash_pool():
+    """返回进程内共享的 HashPool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashPool()
+        return _pool
@@ -1,12 +1,17 @@
 import os
 import json
 import logging
+import itertools
 import threading
-from queue import Queue
+import time
+from collections import OrderedDict, deque
+from queue import PriorityQueue
 from tkinter import Tk, Canvas, Frame, Scrollbar
 from PIL import Image, ImageTk  # 使用 PIL 来处理图片
 
-from sync.config_store import get_config, set_config
+from sync.avatar_index import load_avatar_index
+from sync.config_store import get_config, set_config, poll_config
+from sync.thumbnail_cache import ThumbnailCache
 
 # 配置日志格式
 logging.basicConfig(
@@ -119,42 +124,108 @@ class Graph(Canvas):
 
 
 class ImageLoader:
-    """Background image loader with caching"""
+    """
+    后台缩略图加载器：
+    - 工作线程只负责解码、缩放，产出原始 RGBA 数据，不接触任何 Tk 对象；
+    - Tk 主循环通过 after() 定期取出结果，在每帧的时间预算内批量创建 PhotoImage 并回调；
+    - 内存缓存按 LRU 淘汰，最多保留 cache_size 张图片；
+    - 请求按优先级排队，数值越小越先加载（可见单元格为 0）；
+    - 每个索引带有代数令牌，取消或重新请求后，队列中的旧请求会被直接丢弃。
+    """
 
-    def __init__(self, max_workers=4):
-        self.queue = Queue()
-        self.cache = {}
+    def __init__(self, max_workers=4, thumbnails=None, cache_size=512, root=None,
+                 poll_interval_ms=16, frame_budget=0.008):
+        """
+        :param max_workers: 解码线程数
+        :param thumbnails: 磁盘缩略图缓存
+        :param cache_size: 内存中最多缓存的图片数
+        :param root: Tk 主窗口，用于在主线程中交付结果
+        :param poll_interval_ms: 没有待交付结果时的轮询间隔（毫秒）
+        :param frame_budget: 每轮交付结果最多占用的时间（秒）
+        """
+        self.queue = PriorityQueue()
+        self.results = deque()  # 解码完成、等待主线程交付的 (index, generation, size, data, callback)
+        self.thumbnails = thumbnails or ThumbnailCache()
+        self.cache = OrderedDict()  # index -> PhotoImage，按最近使用排序，只在主线程访问
+        self.cache_size = cache_size
+        self.generations = {}  # index -> 当前有效请求的代数
+        self.sequence = itertools.count()  # 同优先级内先进先出
         self.lock = threading.Lock()
-        self.loaded_flags = {}
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+        self.frame_budget = frame_budget
 
         for _ in range(max_workers):
             threading.Thread(target=self._worker, daemon=True).start()
+        if root is not None:
+            root.after(poll_interval_ms, self._deliver)
 
     def _worker(self):
         while True:
-            task = self.queue.get()
-            self._load_image(*task)
+            _, generation, path, index, callback = self.queue.get()
+            if self._is_current(index, generation):
+                self._decode(path, index, generation, callback)
             self.queue.task_done()
 
-    def _load_image(self, path, index, callback):
+    def _is_current(self, index, generation):
+        with self.lock:
+            return self.generations.get(index) == generation
+
+    def _decode(self, path, index, generation, callback):
         try:
-            img = Image.open(path)
-            img = img.resize((100, 100))
-            photo = ImageTk.PhotoImage(img)
-            with self.lock:
-                self.cache[index] = photo
-                self.loaded_flags[index] = True
-            callback(index, photo)
+            img = self.thumbnails.load(path)
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
+            self.results.append((index, generation, img.size, img.tobytes(), callback))
         except Exception as e:
             logging.error(f"Error loading {path}: {e}", exc_info=True)
 
-    def get_or_queue(self, path, index, callback):
+    def _deliver(self):
+        """在 Tk 主线程中批量创建 PhotoImage 并回调，超出本帧预算的结果留到下一轮"""
+        deadline = time.perf_counter() + self.frame_budget
+        while self.results and time.perf_counter() < deadline:
+            index, generation, size, data, callback = self.results.popleft()
+            with self.lock:
+                current = self.generations.get(index) == generation
+                if current:
+                    del self.generations[index]
+            if not current:
+                continue
+            photo = ImageTk.PhotoImage(Image.frombuffer("RGBA", size, data, "raw", "RGBA", 0, 1))
+            self._cache_put(index, photo)
+            callback(index, photo)
+        # 还有积压时尽快进入下一轮，让事件循环先处理滚动和绘制
+        self.root.after(1 if self.results else self.poll_interval_ms, self._deliver)
+
+    def _cache_put(self, index, photo):
+        self.cache[index] = photo
+        self.cache.move_to_end(index)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get_or_queue(self, path, index, callback, priority=0):
+        """
+        返回缓存中的图片；未缓存时按优先级排队加载，返回 None。
+        :param path: 图片路径
+        :param index: 图片索引
+        :param callback: 加载完成后的回调 callback(index, photo)
+        :param priority: 优先级，数值越小越先加载
+        """
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
         with self.lock:
-            if index in self.cache:
-                return self.cache[index]
-            self.queue.put((path, index, callback))
+            # 序号全局递增，同时作为代数令牌，取消后重新请求也不会与旧请求混淆
+            generation = next(self.sequence)
+            self.generations[index] = generation
+            self.queue.put((priority, generation, path, index, callback))
         return None
 
+    def cancel(self, index):
+        """取消索引对应的未完成请求"""
+        with self.lock:
+            self.generations.pop(index, None)
+
 # 新增方法：窗口居中逻辑
 def center_window(root, width_ratio=0.618, height_ratio=0.618):
     """
@@ -179,41 +250,98 @@ def center_window(root, width_ratio=0.618, height_ratio=0.618):
     root.geometry(f"{window_width}x{window_height}+{x}+{y}")
 
 
+class IncludeSelection:
+    """
+    头像选中状态：点击只修改内存中的集合，
+    一个批次窗口内的所有修改合并后一次性写回 include_dirs。
+    """
+
+    def __init__(self, delay_ms=500):
+        """
+        :param delay_ms: 第一次修改后延迟多久写回数据库（毫秒）
+        """
+        self.delay_ms = delay_ms
+        self.keys = set(json.loads(get_config("include_dirs", "[]")))
+        self.pending = {}  # key -> 'add' 或 'remove'，尚未写回的修改
+        self.root = None
+        self.flush_job = None
+
+    def attach(self, root):
+        """绑定 Tk 主窗口，之后的修改通过 after() 延迟写回；传入 None 时立即写回"""
+        self.root = root
+        self.flush_job = None
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def update(self, key, action):
+        """
+        修改选中状态
+        :param key: 头像文件名（不含扩展名）
+        :param action: 'add' 或 'remove'
+        """
+        if action == 'add':
+            self.keys.add(key)
+        elif action == 'remove':
+            self.keys.discard(key)
+        else:
+            return
+        self.pending[key] = action
+
+        if self.root is None:
+            self.flush()
+        elif self.flush_job is None:
+            self.flush_job = self.root.after(self.delay_ms, self.flush)
+
+    def flush(self):
+        """将累积的修改合并到数据库中最新的 include_dirs 上并写回"""
+        self.flush_job = None
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+
+        # 只应用本批次的增删，避免覆盖其他进程在此期间写入的规则
+        poll_config()
+        includes = json.loads(get_config("include_dirs", "[]"))
+        for key, action in pending.items():
+            if action == 'add' and key not in includes:
+                includes.append(key)
+            elif action == 'remove' and key in includes:
+                includes.remove(key)
+
+        set_config("include_dirs", json.dumps(includes))
+        self.keys = set(includes)
+        logging.info(f"已写回 {len(pending)} 项头像选择，当前共 {len(includes)} 项")
+
+
+_selection = None
+
+
+def get_selection():
+    """返回全局的头像选中状态"""
+    global _selection
+    if _selection is None:
+        _selection = IncludeSelection()
+    return _selection
+
+
 def update_config_includes(file_name, action):
     """
-    更新配置文件中的 includes 列表。
+    更新 includes 列表，修改会在批次窗口结束时写回数据库。
     :param file_name: 文件名
     :param action: 'add' 或 'remove'
     """
-    config = get_config("include_dirs", "[]")  # 从数据库中获取 includes 列表
-    includes = json.loads(config)  # 将 JSON 字符串转换为 Python 列表
-
-    key = file_name[:-4]
-    if action == 'add' and key not in includes:
-        includes.append(key)
-    elif action == 'remove' and key in includes:
-        includes.remove(key)
-
-    set_config("include_dirs", json.dumps(includes))  # 将更新后的列表保存回数据库
+    get_selection().update(file_name[:-4], action)
 
 
 def find_avatar_files(base_wechat_dir):
-    """递归查找 Avatar 子文件夹中的 jpg 文件"""
-    avatar_files = []
-    for root, dirs, files in os.walk(base_wechat_dir):
-        if "Avatar" in dirs:
-            avatar_dir = os.path.join(root, "Avatar")
-            for file in os.listdir(avatar_dir):
-                if file.endswith(".jpg"):
-                    avatar_files.append(os.path.join(avatar_dir, file))
-    return avatar_files
+    """从头像索引中获取所有头像文件，索引缺失时先构建"""
+    return load_avatar_index(base_wechat_dir)
 
 
 def get_includes():
-    """从数据库中获取 includes 列表，并缓存结果"""
-    if not hasattr(get_includes, 'cached_includes'):
-        get_includes.cached_includes = json.loads(get_config("include_dirs", "[]"))
-    return get_includes.cached_includes
+    """返回当前选中的 includes 集合（含尚未写回数据库的修改）"""
+    return get_selection().keys
 
 
 class ConfigParams:
@@ -227,6 +355,24 @@ class ConfigParams:
         self.height_ratio = 0.618  # 窗口高度比例
 
 
+def draw_selection(canvas, index):
+    """
+    在单元格上绘制选中蒙层（不修改配置）
+    :param canvas: 单元格画布
+    :param index: 图片索引
+    """
+    overlay_tag = f"overlay_{index}"
+    if canvas.find_withtag(overlay_tag):
+        return
+    canvas.draw_rectangle_overlay(
+        0, 0, int(canvas.cget("width")), int(canvas.cget("height")),
+        fill='green',
+        alpha=.5,
+        tags=(overlay_tag, 'overlay'),
+        outline=''
+    )
+
+
 def toggle_selection(canvas, index, file_name, action):
     """
     抽象的选中/反选逻辑
@@ -240,136 +386,203 @@ def toggle_selection(canvas, index, file_name, action):
 
     if overlays and action == 'remove':
         # 反选：移除蒙层并从 includes 移除文件名
-        for overlay in overlays:
-            canvas.delete_overlay(overlay)
+        canvas.delete_overlay('overlay')
         print(f"Removed overlay for item {index}")
         update_config_includes(file_name, 'remove')
     elif action == 'add':
         # 选中：添加蒙层并将文件名加入 includes
-        x1, y1, x2, y2 = canvas.get_object_bbox(canvas.image_id)
-        canvas.draw_rectangle_overlay(
-            x1, y1, x2, y2,
-            fill='green',
-            alpha=.5,
-            tags=(overlay_tag, 'overlay'),
-            outline=''
-        )
+        draw_selection(canvas, index)
         print(f"Added overlay for item {index}")
         update_config_includes(file_name, 'add')
 
-def handle_selection_lazy(event, index, file_name, cell_grid):
-    """
-    懒加载模式下的选中/反选处理函数
-    :param event: Tkinter 事件
-    :param index: 图像索引
-    :param file_name: 文件名
-    :param cell_grid: 所有 Canvas 单元格列表
-    """
-    canvas = cell_grid[index]
-    file_name = os.path.basename(file_name)
-    if not canvas.get_item_by_index(index):
-        toggle_selection(canvas, index, file_name, 'add')
-    else:
-        toggle_selection(canvas, index, file_name, 'remove')
-
-def initialize_selected_avatars(cell_grid, index, image_paths, loader):
+
+class VirtualAvatarGrid:
     """
-    启动时初始化已选中的头像文件
-    :param cell_grid: 所有 Graph 对象列表
-    :param index: 图片索引
-    :param image_paths: 所有头像文件路径
-    :param loader: 图像加载器实例
+    虚拟化头像网格：只保留可见行（加上下余量）所需的单元格控件，
+    滚动时复用离开可见区域的单元格，可见索引区间由滚动位置直接换算。
     """
-    includes = get_includes()  # 使用缓存的 includes 列表
-    # 检查索引是否有效
-    if index < 0 or index >= len(image_paths):
-        logging.warning(f"Invalid index {index} for image_paths")
-        return
-
-    path = image_paths[index]
-    # 检查路径是否有效
-    if not path or not os.path.exists(path):
-        logging.warning(f"Invalid or non-existent path: {path}")
-        return
 
-    file_name = os.path.basename(path)
-    key = file_name[:-4]
-    if key in includes:
-        # 直接从 cell_grid 列表中获取对应的 Graph 对象
-        graph_canvas = cell_grid[index]
-        # 确保图像已加载完成后再进行操作
-        if loader.loaded_flags.get(index, False):
-            # 使用 get_item_by_index 方法获取 Canvas 对象
-            if not graph_canvas.get_item_by_index(index):
-                toggle_selection(graph_canvas, index, file_name, 'add')
-
-def setup_grid_layout_lazy(scrollable_frame, config_params, image_paths, loader):
-    """Optimized grid layout with lazy loading and selection support"""
-
-    def update_cell(index, photo, cell_grid):
-        if index < len(cell_grid):
-            canvas = cell_grid[index]
-            # 如果还没有创建图像对象，则创建一个
-            if not hasattr(canvas, 'image_id'):
-                image_id = canvas.create_image(50, 50, image=photo)
-                canvas.image_id = image_id  # 保存 ID 以便后续更新
-            else:
-                # 更新已有的图像
-                canvas.itemconfig(canvas.image_id, image=photo)
-            canvas.photo = photo  # 防止被垃圾回收
-            loader.loaded_flags[index] = True
-
-            # 启动时初始化已选中的头像文件
-            initialize_selected_avatars(cell_grid, index, image_paths, loader)
-
-    cell_grid = []
-    for i, path in enumerate(image_paths):
-        canvas = Graph(
-            scrollable_frame,
-            width=100,
-            height=100,
+    def __init__(self, scrollable_frame, config_params, image_paths, loader, margin_rows=2, cell_size=100):
+        """
+        :param scrollable_frame: 放置单元格的 Frame（其 master 为滚动画布）
+        :param config_params: 网格配置参数
+        :param image_paths: 所有头像文件路径
+        :param loader: 图像加载器实例
+        :param margin_rows: 可见区域上下额外保留的行数
+        :param cell_size: 单元格边长（像素）
+        """
+        self.frame = scrollable_frame
+        self.canvas = scrollable_frame.master
+        self.config_params = config_params
+        self.image_paths = image_paths
+        self.loader = loader
+        self.margin_rows = margin_rows
+        self.cell_size = cell_size
+        self.columns = config_params.columns
+        self.pitch_x = cell_size + 2 * config_params.padding_x
+        self.pitch_y = cell_size + 2 * config_params.padding_y
+        self.rows = (len(image_paths) + self.columns - 1) // self.columns
+        self.total_height = self.rows * self.pitch_y
+
+        self.bound = {}  # 图片索引 -> 正在显示该图片的单元格
+        self.free = []  # 空闲单元格
+        self.cell_count = 0
+        self.refresh_pending = False
+
+        # place 布局不会撑开父容器，需要显式指定整个网格的尺寸，滚动区域据此计算
+        scrollable_frame.configure(width=self.columns * self.pitch_x, height=max(self.total_height, 1))
+
+    def visible_rows(self):
+        """
+        根据滚动位置计算窗口内实际可见的行号区间
+        :return: (首行, 末行)，闭区间
+        """
+        viewport = self.canvas.winfo_height()
+        if viewport <= 1:
+            # 窗口尚未显示时按默认行数估算
+            viewport = self.config_params.rows_per_column * self.pitch_y
+        top = int(self.canvas.yview()[0] * self.total_height)
+        return top // self.pitch_y, (top + viewport - 1) // self.pitch_y
+
+    def visible_range(self, rows=None):
+        """
+        计算需要绑定单元格的图片索引区间（可见行加上下余量）
+        :param rows: 已计算好的可见行区间
+        :return: (起始索引, 结束索引)，左闭右开
+        """
+        first_row, last_row = rows or self.visible_rows()
+        first_row = max(first_row - self.margin_rows, 0)
+        last_row = min(last_row + self.margin_rows, self.rows - 1)
+        return first_row * self.columns, min((last_row + 1) * self.columns, len(self.image_paths))
+
+    @staticmethod
+    def _priority(row, rows):
+        """可见行优先级为 0，余量行按与可见区域的距离递增"""
+        first_row, last_row = rows
+        return max(first_row - row, row - last_row, 0)
+
+    def schedule_refresh(self, *args):
+        """合并同一轮事件循环中的多次滚动通知"""
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.canvas.after_idle(self.refresh)
+
+    def refresh(self):
+        """回收离开可见区域的单元格，并为新进入的索引绑定单元格"""
+        self.refresh_pending = False
+        rows = self.visible_rows()
+        start, end = self.visible_range(rows)
+
+        for index in [i for i in self.bound if i < start or i >= end]:
+            self._release(index)
+        for index in range(start, end):
+            cell = self.bound.get(index)
+            if cell is None:
+                self._bind(index, rows)
+            elif cell.photo is None:
+                # 仍在加载中的单元格按新的滚动位置调整优先级
+                priority = self._priority(index // self.columns, rows)
+                if priority != cell.priority:
+                    self._request(cell, index, priority)
+
+        # 本轮没有被复用的单元格从界面上移除
+        for cell in self.free:
+            cell.place_forget()
+
+    def _acquire_cell(self):
+        if self.free:
+            return self.free.pop()
+        cell = Graph(
+            self.frame,
+            width=self.cell_size,
+            height=self.cell_size,
             highlightthickness=0,
             bg="white"
         )
-        canvas.grid(
-            row=i // config_params.rows_per_column,
-            column=i % config_params.columns,
-            padx=config_params.padding_x,
-            pady=config_params.padding_y,
-            sticky="nsew"
+        cell.index = None
+        cell.photo = None
+        cell.priority = None
+        cell.image_id = cell.create_image(self.cell_size // 2, self.cell_size // 2)
+        cell.bind("<Button-1>", lambda e, c=cell: self._on_click(c))
+        self.cell_count += 1
+        return cell
+
+    def _bind(self, index, rows):
+        cell = self._acquire_cell()
+        cell.index = index
+        self.bound[index] = cell
+
+        row, column = divmod(index, self.columns)
+        cell.place(
+            x=column * self.pitch_x + self.config_params.padding_x,
+            y=row * self.pitch_y + self.config_params.padding_y
         )
-        cell_grid.append(canvas)
-
-        # 创建点击处理器并绑定
-        file_name = os.path.basename(path)
-        handler = lambda e, idx=i, fn=file_name: handle_selection_lazy(e, idx, fn, cell_grid)
-        canvas.bind("<Button-1>", handler)
-
-    # 初始化滚动区域大小
-    rows = (len(image_paths) + config_params.columns - 1) // config_params.columns
-    total_height = rows * (100 + config_params.padding_y) + config_params.padding_y
-    scrollable_frame.master.configure(scrollregion=(0, 0, 0, total_height))
+        self._request(cell, index, self._priority(row, rows))
+
+        if self._is_selected(index):
+            draw_selection(cell, index)
+
+    def _request(self, cell, index, priority):
+        photo = self.loader.get_or_queue(self.image_paths[index], index, self._on_loaded, priority)
+        cell.itemconfig(cell.image_id, image=photo or "")
+        cell.photo = photo  # 防止被垃圾回收
+        cell.priority = priority
+
+    def _release(self, index):
+        cell = self.bound.pop(index)
+        if cell.photo is None:
+            self.loader.cancel(index)
+        cell.index = None
+        cell.delete_overlay('overlay')
+        cell.itemconfig(cell.image_id, image="")
+        cell.photo = None
+        cell.priority = None
+        self.free.append(cell)
+
+    def _is_selected(self, index):
+        key = os.path.basename(self.image_paths[index])[:-4]
+        return key in get_includes()
+
+    def _on_loaded(self, index, photo):
+        cell = self.bound.get(index)
+        if cell is None:
+            # 已滚出可见区域，下次进入时直接使用加载器中的缓存
+            return
+        cell.itemconfig(cell.image_id, image=photo)
+        cell.photo = photo
 
-    # 立即加载可见区域图像
-    for i in range(config_params.rows_per_column * config_params.columns):
-        if i < len(image_paths):
-            loader.get_or_queue(image_paths[i], i, lambda idx, photo: update_cell(idx, photo, cell_grid))
+    def _on_click(self, cell):
+        index = cell.index
+        if index is None:
+            return
+        file_name = os.path.basename(self.image_paths[index])
+        action = 'remove' if cell.get_item_by_index(index) else 'add'
+        toggle_selection(cell, index, file_name, action)
 
-    def on_scroll(*args):
-        visible_start = scrollable_frame.winfo_y()
-        visible_end = visible_start + scrollable_frame.winfo_height()
 
-        for i, path in enumerate(image_paths):
-            row = i // config_params.columns
-            y_start = row * (100 + config_params.padding_y)
-            y_end = y_start + 100
+def setup_grid_layout_lazy(scrollable_frame, config_params, image_paths, loader, scrollbar=None):
+    """
+    虚拟化网格布局：按需加载可见区域的头像并支持选中
+    :param scrollable_frame: 放置单元格的 Frame
+    :param config_params: 网格配置参数
+    :param image_paths: 所有头像文件路径
+    :param loader: 图像加载器实例
+    :param scrollbar: 滚动条，画布滚动时同步其位置
+    :return: VirtualAvatarGrid
+    """
+    grid = VirtualAvatarGrid(scrollable_frame, config_params, image_paths, loader)
+    canvas = scrollable_frame.master
 
-            if y_start <= visible_end + 300 and y_end >= visible_start - 300:
-                if not loader.loaded_flags.get(i, False):
-                    loader.get_or_queue(path, i, lambda idx, photo: update_cell(idx, photo, cell_grid))
+    # 画布的任何滚动（滚轮、拖动滚动条、窗口缩放）都会回调 yscrollcommand
+    def on_yscroll(first, last):
+        if scrollbar is not None:
+            scrollbar.set(first, last)
+        grid.schedule_refresh()
 
-    scrollable_frame.bind("<Configure>", lambda e: on_scroll())
-    scrollable_frame.bind("<MouseWheel>", lambda e: on_scroll())
+    canvas.configure(yscrollcommand=on_yscroll)
+    canvas.bind("<Configure>", grid.schedule_refresh, add="+")
+    grid.refresh()
+    return grid
 
 def setup_scroll_management(canvas):
     """设置滚动管理"""
@@ -402,13 +615,19 @@ def display_avatar_gui(base_wechat_dir):
     avatar_files = find_avatar_files(base_wechat_dir)
 
     # 5. 加载图像并布局网格（预留懒加载扩展点）
-    loader = ImageLoader(max_workers=4)
-    setup_grid_layout_lazy(scrollable_frame, ConfigParams(), avatar_files, loader)
+    selection = get_selection()
+    selection.attach(root)
+    loader = ImageLoader(max_workers=4, root=root)
+    setup_grid_layout_lazy(scrollable_frame, ConfigParams(), avatar_files, loader, scrollbar)
     # loaded_images = []
     # load_next_images(avatar_files, loaded_images, scrollable_frame, ConfigParams())
 
     root.mainloop()
 
+    # 窗口关闭后写回尚未提交的选择
+    selection.attach(None)
+    selection.flush()
+
 
 def create_main_container(root):
     """创建主画布和滚动区域"""
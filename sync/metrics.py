@@ -0,0 +1,305 @@
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + parts + "}"
+
+
+class _Metric:
+    """指标族：同名指标按标签组合拆分为多个子项"""
+
+    type_name = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self.lock:
+            child = self.children.get(key)
+            if child is None:
+                child = self.children[key] = self._new_child()
+            return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self.lock:
+            children = list(self.children.items())
+        for labels, child in children:
+            lines.extend(child.render(self.name, labels))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f"{name}{_format_labels(labels)} {self.value}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """渲染时调用 function 获取当前值"""
+        self.function = function
+
+    def render(self, name, labels):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float("nan")
+        return [f"{name}{_format_labels(labels)} {value}"]
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.total += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self, name, labels):
+        with self.lock:
+            counts, total, total_sum = list(self.counts), self.total, self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            bucket_labels = labels + (("le", repr(float(bound))),)
+            lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {total}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total_sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {total}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    """分桶统计的直方图，常用于记录耗时"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        """用于 with 语句的计时器"""
+        return self._default().time()
+
+
+class Registry:
+    """指标注册表，负责输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+FILES_SEEN = REGISTRY.register(Counter("wechat_backup_files_seen_total", "交给 backup_file 处理的文件数"))
+FILES_SKIPPED = REGISTRY.register(Counter("wechat_backup_files_skipped_total", "按原因统计的跳过文件数"))
+FILES_DEDUPED = REGISTRY.register(Counter("wechat_backup_files_deduped_total", "内容重复、以链接方式备份的文件数"))
+FILES_COPIED = REGISTRY.register(Counter("wechat_backup_files_copied_total", "实际复制的文件数"))
+FILES_FAILED = REGISTRY.register(Counter("wechat_backup_files_failed_total", "备份出错的文件数"))
+BYTES_COPIED = REGISTRY.register(Counter("wechat_backup_bytes_copied_total", "实际复制的字节数"))
+HASH_SECONDS = REGISTRY.register(Histogram("wechat_backup_hash_seconds", "查重时计算哈希的耗时"))
+COPY_SECONDS = REGISTRY.register(Histogram("wechat_backup_copy_seconds", "复制或链接单个文件的耗时"))
+DB_WRITE_SECONDS = REGISTRY.register(Histogram("wechat_backup_db_write_seconds", "一次批量写入事务的耗时"))
+DB_WRITE_ROWS = REGISTRY.register(Counter("wechat_backup_db_write_rows_total", "批量写入的语句数"))
+EVENT_QUEUE_DEPTH = REGISTRY.register(Gauge("wechat_backup_event_queue_depth", "等待稳定的文件事件数"))
+COPY_QUEUE_DEPTH = REGISTRY.register(Gauge("wechat_backup_copy_queue_depth", "复制调度器中排队的文件数"))
+WATCHED_DIRECTORIES = REGISTRY.register(Gauge("wechat_backup_watched_directories", "建立了文件事件监听的目录数"))
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    日志限流：每个时间窗口内最多放行 rate 条记录，
+    被丢弃的条数在下一个窗口的第一条记录中补充说明。
+    """
+
+    def __init__(self, rate=20, per=1.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.window_start = 0.0
+        self.allowed = 0
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.per:
+                if self.suppressed:
+                    record.msg = f"{record.msg}（此前 {self.suppressed} 条日志因限流被省略）"
+                self.window_start = now
+                self.allowed = 0
+                self.suppressed = 0
+            if self.allowed < self.rate:
+                self.allowed += 1
+                return True
+            self.suppressed += 1
+            return False
+
+
+def get_file_logger():
+    """逐文件日志使用的 logger：调试级别并且限流"""
+    logger = logging.getLogger("wechat_backup.files")
+    if not any(isinstance(f, RateLimitFilter) for f in logger.filters):
+        logger.addFilter(RateLimitFilter())
+    return logger
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_textfile(path):
+    """以原子替换的方式写出 Prometheus 文本文件（供 node_exporter textfile collector 读取）"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+def start_exporter(port=None, textfile=None, interval=15.0, host="127.0.0.1"):
+    """
+    启动指标输出。
+    :param port: 本地 HTTP 端口，为 None 时不启动 HTTP 服务
+    :param textfile: 定期写出的文本文件路径，为 None 时不写文件
+    :param interval: 写文本文件的间隔（秒）
+    :param host: HTTP 服务监听地址
+    :return: HTTP 服务对象，未启动时为 None
+    """
+    server = None
+    if port:
+        server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="MetricsHTTP", daemon=True).start()
+        logging.info(f"指标服务已启动: http://{host}:{port}/metrics")
+
+    if textfile:
+        def loop():
+            while True:
+                try:
+                    write_textfile(textfile)
+                except OSError as e:
+                    logging.warning(f"写出指标文件 {textfile} 失败: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="MetricsTextfile", daemon=True).start()
+
+    return server
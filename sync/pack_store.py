@@ -0,0 +1,273 @@
+import argparse
+import logging
+import os
+import tarfile
+import threading
+from collections import OrderedDict
+
+from .config_store import add_packed, find_packed, get_config, get_packed, list_packed, packed_end
+from .hashing import current_algorithm, new_hasher
+
+# 包文件存放在备份目录下的该子目录中
+PACK_DIR_NAME = ".packs"
+PACK_PREFIX = "pack-"
+PACK_SUFFIX = ".tar"
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+# tar 结束标记为两个全零块
+END_MARKER_SIZE = BLOCK_SIZE * 2
+
+DEFAULT_PACK_FILE_MAX_SIZE = 1024 * 1024
+DEFAULT_PACK_SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+def target_mode():
+    """备份目标模式：'files' 为镜像目录树，'packed' 为小文件写入包文件"""
+    return get_config("target_mode", "files")
+
+
+def pack_file_max_size():
+    """小于该字节数的文件在打包模式下写入包文件"""
+    return int(get_config("pack_file_max_size", str(DEFAULT_PACK_FILE_MAX_SIZE)))
+
+
+def _padded(size):
+    return (size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+def _pack_number(pack_name):
+    return int(pack_name[len(PACK_PREFIX):-len(PACK_SUFFIX)])
+
+
+def _complete_end(path):
+    """包文件中最后一个完整成员之后的位置，崩溃时写了一半的成员和结束标记不计入"""
+    size = os.path.getsize(path)
+    end = 0
+    try:
+        with tarfile.open(path, "r:") as tar:
+            for member in tar:
+                member_end = member.offset_data + _padded(member.size)
+                if member_end > size:
+                    break
+                end = member_end
+    except tarfile.TarError:
+        # 空文件或损坏的成员头，保留此前完整的成员
+        pass
+    return end
+
+
+class PackStore:
+    """
+    将小文件依次追加到滚动的 tar 包文件中，每个包达到 segment_size 后换新包。
+    每个成员的数据位置登记在数据库的 packed_files 表中，可以直接定位读取；
+    已写完的包带有 tar 结束标记，也可以用 tar 命令直接解开。
+    内容相同的文件只写入一次，多个路径指向包内同一段数据。
+    """
+
+    def __init__(self, target_dir, segment_size=DEFAULT_PACK_SEGMENT_SIZE, recent_size=10000):
+        """
+        :param target_dir: 备份目标目录
+        :param segment_size: 单个包文件的目标大小
+        :param recent_size: 内存中保留的最近写入内容数，用于数据库尚未提交时的去重
+        """
+        self.target_dir = target_dir
+        self.pack_dir = os.path.join(target_dir, PACK_DIR_NAME)
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.recent = OrderedDict()  # (size, full_hash, hash_algo) -> (pack_name, data_offset)
+        self.recent_size = recent_size
+        self.pack_name = None
+        self.pack_file = None
+        os.makedirs(self.pack_dir, exist_ok=True)
+
+    def pack_path(self, pack_name):
+        return os.path.join(self.pack_dir, pack_name)
+
+    def _pack_names(self):
+        return sorted(name for name in os.listdir(self.pack_dir)
+                      if name.startswith(PACK_PREFIX) and name.endswith(PACK_SUFFIX))
+
+    def _open_current(self):
+        """
+        启动后第一次写入时打开最后一个包继续追加，截掉最后一个完整成员之后的数据（崩溃时写了一半的成员或结束标记）。
+        截断位置按包文件本身的 tar 结构确定而不是按数据库中的登记，数据库重建或登记尚未提交时不会丢掉有效的成员。
+        该包已满，或其中有已登记的数据不完整时换新包。
+        """
+        names = self._pack_names()
+        if not names:
+            self._open_new(1)
+            return
+        name = names[-1]
+        end = _complete_end(self.pack_path(name))
+        if _padded(packed_end(name)) > end:
+            # 已登记的数据超出了包中完整的部分，不在其后追加，避免这些登记指向新写入的数据
+            logging.warning(f"包文件 {name} 中有已登记的数据不完整，后续数据写入新包")
+        elif end < self.segment_size:
+            self.pack_name = name
+            self.pack_file = open(self.pack_path(name), "r+b")
+            self.pack_file.truncate(end)
+            self.pack_file.seek(end)
+            return
+        self._open_new(_pack_number(name) + 1)
+
+    def _open_new(self, number):
+        """创建并打开编号为 number 的新包"""
+        self.pack_name = f"{PACK_PREFIX}{number:06d}{PACK_SUFFIX}"
+        self.pack_file = open(self.pack_path(self.pack_name), "w+b")
+
+    def _finish_current(self):
+        """写入 tar 结束标记并关闭当前包"""
+        if self.pack_file is None:
+            return
+        self.pack_file.write(b"\0" * END_MARKER_SIZE)
+        self.pack_file.flush()
+        os.fsync(self.pack_file.fileno())
+        self.pack_file.close()
+        self.pack_file = None
+        self.pack_name = None
+
+    def add(self, rel_path, src_path, st):
+        """
+        将源文件写入包中并登记。
+        :param rel_path: 相对备份目录的路径
+        :param src_path: 源文件路径
+        :param st: 源文件的 stat 信息
+        :return: 'pack' 表示写入了新数据，'dedup' 表示复用了已有数据
+        """
+        with open(src_path, "rb") as f:
+            data = f.read()
+        algorithm = current_algorithm()
+        hasher = new_hasher(algorithm)
+        hasher.update(data)
+        full_hash = hasher.hexdigest()
+        key = (len(data), full_hash, algorithm)
+
+        with self.lock:
+            location = self.recent.get(key) or find_packed(*key)
+            if location is not None:
+                add_packed(rel_path, location[0], location[1], len(data), st.st_mtime_ns, full_hash, algorithm)
+                return "dedup"
+
+            if self.pack_file is None:
+                self._open_current()
+            info = tarfile.TarInfo(rel_path.replace(os.sep, "/"))
+            info.size = len(data)
+            info.mtime = st.st_mtime
+            info.mode = 0o644
+            header = info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8")
+
+            offset = self.pack_file.tell()
+            # 结束标记同样计入包的大小
+            if offset and offset + len(header) + _padded(len(data)) + END_MARKER_SIZE > self.segment_size:
+                # 当前包已满，写入结束标记后换下一个编号的新包，不再重新打开已写完的包
+                number = _pack_number(self.pack_name) + 1
+                self._finish_current()
+                self._open_new(number)
+                offset = 0
+
+            data_offset = offset + len(header)
+            self.pack_file.write(header)
+            self.pack_file.write(data)
+            self.pack_file.write(b"\0" * (_padded(len(data)) - len(data)))
+            self.pack_file.flush()
+
+            add_packed(rel_path, self.pack_name, data_offset, len(data), st.st_mtime_ns, full_hash, algorithm)
+            self.recent[key] = (self.pack_name, data_offset)
+            if len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+        return "pack"
+
+    def read(self, rel_path):
+        """读取已打包文件的内容，未打包时返回 None"""
+        entry = get_packed(rel_path)
+        if entry is None:
+            return None
+        pack_name, data_offset, size, _ = entry
+        with open(self.pack_path(pack_name), "rb") as f:
+            f.seek(data_offset)
+            return f.read(size)
+
+    def extract(self, rel_path, dest_path):
+        """
+        将已打包文件还原到 dest_path。
+        :return: 是否找到该文件
+        """
+        entry = get_packed(rel_path)
+        if entry is None:
+            return False
+        pack_name, data_offset, size, mtime_ns = entry
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        with open(self.pack_path(pack_name), "rb") as src, open(dest_path, "wb") as dst:
+            src.seek(data_offset)
+            remaining = size
+            while remaining:
+                chunk = src.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise OSError(f"包文件 {pack_name} 数据不完整: {rel_path}")
+                dst.write(chunk)
+                remaining -= len(chunk)
+        os.utime(dest_path, ns=(mtime_ns, mtime_ns))
+        return True
+
+    def extract_all(self, dest_dir, prefix=""):
+        """
+        将所有（或指定前缀下的）已打包文件还原到 dest_dir 下的原始相对路径。
+        :return: 还原的文件数
+        """
+        count = 0
+        for rel_path, _, _, _, _ in list_packed():
+            if rel_path.startswith(prefix):
+                self.extract(rel_path, os.path.join(dest_dir, rel_path))
+                count += 1
+        return count
+
+    def close(self):
+        """同步当前包的数据到磁盘；下次写入时会截掉结束标记继续追加"""
+        with self.lock:
+            self._finish_current()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_pack_store(target_dir):
+    """返回备份目录对应的 PackStore，同一目录只创建一个实例"""
+    with _stores_lock:
+        store = _stores.get(target_dir)
+        if store is None:
+            store = _stores[target_dir] = PackStore(
+                target_dir,
+                segment_size=int(get_config("pack_segment_size", str(DEFAULT_PACK_SEGMENT_SIZE))),
+            )
+        return store
+
+
+def close_pack_stores():
+    """关闭所有打开的包文件"""
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看或还原打包模式下的备份文件")
+    parser.add_argument("target_dir", help="备份目录，例如 ~/WeChatBackup")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出已打包的文件")
+    extract = sub.add_parser("extract", help="还原已打包的文件")
+    extract.add_argument("dest_dir", help="还原到的目录")
+    extract.add_argument("--prefix", default="", help="只还原该相对路径前缀下的文件")
+    args = parser.parse_args()
+
+    store = PackStore(os.path.expanduser(args.target_dir))
+    if args.command == "list":
+        for rel_path, pack_name, data_offset, size, _ in list_packed():
+            print(f"{rel_path}\t{pack_name}\t{data_offset}\t{size}")
+    else:
+        count = store.extract_all(os.path.expanduser(args.dest_dir), args.prefix)
+        print(f"已还原 {count} 个文件到 {args.dest_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import heapq
+import logging
+import os
+import threading
+import time
+
+from watchdog.events import DirDeletedEvent, FileCreatedEvent, FileModifiedEvent
+
+from .config_store import get_config, get_manifest, list_dir_states, set_dir_state
+from .rules import get_matcher
+from .sync_logic import process_directory
+from .walker import RACY_MTIME_NS
+from .watch_plan import is_covered, plan_watches, should_watch
+
+# 每轮检查之间的间隔（秒）
+POLL_TICK_SECONDS = 1.0
+
+
+def watch_backend():
+    """文件变化的发现方式：'native' 为系统文件事件，'polling' 为对照目录状态轮询"""
+    return get_config("watch_backend", "native")
+
+
+class PollingWatcher:
+    """
+    轮询方式的文件变化监听，用于网络共享、外接磁盘等系统文件事件不可靠的卷。
+    以上次遍历记录的目录状态为快照，每个目录只 stat 一次，修改时间变化后才读取目录内容，
+    新增或变化的文件以文件事件的形式交给同一个事件处理器。
+    每个目录单独安排检查时间：有变化的目录按最短间隔检查，长期不变的目录逐步退避到最长间隔；
+    每轮最多检查 batch_size 个目录，CPU 开销有固定上限。
+    """
+
+    def __init__(self, handler, root, min_interval=None, max_interval=None, batch_size=None):
+        """
+        :param handler: WeChatBackupHandler，新增文件通过其 dispatch 处理
+        :param root: WeChat 容器根目录
+        :param min_interval: 目录有变化后的检查间隔（秒）
+        :param max_interval: 目录长期不变时的最长检查间隔（秒）
+        :param batch_size: 每轮最多检查的目录数
+        """
+        self.handler = handler
+        self.root = os.path.abspath(root)
+        self.min_interval = min_interval or float(get_config("poll_min_interval", "2"))
+        self.max_interval = max_interval or float(get_config("poll_max_interval", "60"))
+        self.batch_size = batch_size or int(get_config("poll_batch_size", "2000"))
+
+        self.lock = threading.RLock()
+        self.dirs = {}  # dir_path -> [mtime_ns, entry_count, interval, due]
+        self.children = {}  # dir_path -> 已跟踪的子目录集合
+        self.heap = []  # (due, dir_path)，due 与 dirs 中不一致的条目在弹出时丢弃
+        self.recursive = set()  # 监听计划中递归跟踪的目录
+        self.signature = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="PollingWatcher", daemon=True)
+
+    def __len__(self):
+        return len(self.dirs)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def join(self, timeout=None):
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def refresh(self, force=False):
+        """
+        按当前规则和已知目录重新计算需要轮询的目录，与 WatchManager.refresh 相同。
+        :param force: 为 False 时规则未变化则不重新计算
+        :return: 新增的递归跟踪目录列表
+        """
+        matcher = get_matcher()
+        signature = matcher.signature()
+        with self.lock:
+            if not force and signature == self.signature:
+                return []
+            self.signature = signature
+            states = list_dir_states(self.root)
+            plan = plan_watches(self.root, states if matcher.includes else (), matcher)
+            added = [path for path, recursive in plan.items() if recursive and path not in self.recursive]
+            self.recursive = {path for path, recursive in plan.items() if recursive}
+
+            tracked = {path for path in states if path in plan or is_covered(self.recursive, self.root, path)}
+            tracked.update(plan)
+            for dir_path in list(self.dirs):
+                if dir_path not in tracked:
+                    self._forget(dir_path)
+            now = time.monotonic()
+            for dir_path in tracked:
+                if dir_path not in self.dirs:
+                    mtime_ns, entry_count = states.get(dir_path, (0, 0))
+                    self._track(dir_path, mtime_ns, entry_count, now)
+        logging.info(f"轮询 {len(self.dirs)} 个目录，其中递归跟踪 {len(self.recursive)} 个")
+        return added
+
+    def poll_once(self, now=None):
+        """
+        检查到期的目录。
+        :return: 本轮检查的目录数
+        """
+        now = time.monotonic() if now is None else now
+        matcher = get_matcher()
+        checked = 0
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now and checked < self.batch_size:
+                due, dir_path = heapq.heappop(self.heap)
+                state = self.dirs.get(dir_path)
+                if state is None or state[3] != due:
+                    continue
+                checked += 1
+                self._check(dir_path, state, matcher, now)
+        return checked
+
+    def _run(self):
+        while not self.stopped.wait(POLL_TICK_SECONDS):
+            try:
+                self.poll_once()
+            except Exception as e:
+                logging.error(f"轮询目录时出错: {e}", exc_info=True)
+
+    def _track(self, dir_path, mtime_ns, entry_count, now):
+        due = now
+        self.dirs[dir_path] = [mtime_ns, entry_count, self.min_interval, due]
+        self.children.setdefault(os.path.dirname(dir_path), set()).add(dir_path)
+        heapq.heappush(self.heap, (due, dir_path))
+
+    def _forget(self, dir_path):
+        """停止跟踪目录及其所有子目录"""
+        stack = [dir_path]
+        while stack:
+            path = stack.pop()
+            self.dirs.pop(path, None)
+            stack.extend(self.children.pop(path, ()))
+        siblings = self.children.get(os.path.dirname(dir_path))
+        if siblings is not None:
+            siblings.discard(dir_path)
+
+    def _check(self, dir_path, state, matcher, now):
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            self.handler.dispatch(DirDeletedEvent(dir_path))
+            self._forget(dir_path)
+            return
+        except OSError as e:
+            logging.warning(f"无法读取目录 {dir_path}: {e}")
+            mtime_ns = state[0]
+
+        if mtime_ns == state[0]:
+            # 没有变化，逐步拉长检查间隔
+            state[2] = min(state[2] * 2, self.max_interval)
+        else:
+            try:
+                entry_count = self._scan(dir_path, matcher)
+            except OSError as e:
+                logging.warning(f"无法读取目录 {dir_path}: {e}")
+                entry_count = state[1]
+                mtime_ns = state[0]
+            else:
+                if time.time_ns() - mtime_ns < RACY_MTIME_NS:
+                    mtime_ns = 0
+                set_dir_state(dir_path, mtime_ns, entry_count)
+            state[0], state[1], state[2] = mtime_ns, entry_count, self.min_interval
+        state[3] = now + state[2]
+        heapq.heappush(self.heap, (state[3], dir_path))
+
+    def _scan(self, dir_path, matcher):
+        """
+        读取发生变化的目录：新增或变化的文件交给事件处理器，新出现的子目录完整遍历，消失的子目录停止跟踪。
+        :return: 目录条目数
+        """
+        entry_count = 0
+        subdirs = set()
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                entry_count += 1
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.add(entry.path)
+                        continue
+                    if not matcher.match_file_type(entry.name):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                manifest = get_manifest(entry.path)
+                if manifest == (st.st_size, st.st_mtime_ns, st.st_ino):
+                    continue
+                event_class = FileCreatedEvent if manifest is None else FileModifiedEvent
+                self.handler.dispatch(event_class(entry.path))
+
+        known = self.children.get(dir_path, set())
+        for sub_path in known - subdirs:
+            self.handler.dispatch(DirDeletedEvent(sub_path))
+            self._forget(sub_path)
+        added = False
+        for sub_path in subdirs - known:
+            # 被排除的子目录不会被跟踪，每次读取父目录时都会出现在这里，直接跳过
+            if matcher.should_prune(os.path.basename(sub_path)):
+                continue
+            if not (dir_path in self.recursive or is_covered(self.recursive, self.root, dir_path)):
+                if not should_watch(self.root, sub_path, matcher):
+                    continue
+            # 新目录中已有的文件直接遍历备份，遍历记录的目录状态随后用于跟踪
+            stats = process_directory(sub_path, self.handler.target_dir, self.handler.base_wechat_dir,
+                                      self.handler.scheduler)
+            added = added or stats.dirs > 0
+        if added:
+            # 只有确实记录了新目录时才重新计算跟踪集合
+            self.refresh(force=True)
+        return entry_count
@@ -0,0 +1,60 @@
+import logging
+import os
+import time
+
+from .config_store import flush, get_config, list_dir_states, remove_dir_states, set_config
+from .rules import get_matcher
+from .sharded_sync import full_sync
+from .sync_logic import process_directory
+from .walker import WalkStats
+
+
+def reconcile_changes(root, target_dir, base_wechat_dir, scheduler=None, matcher=None, full=False):
+    """
+    启动时补备份守护进程停止期间新增的文件。
+    只对上次遍历记录过的每个目录做一次 stat，修改时间变化的目录才重新读取，
+    其中新出现的子目录整体遍历；没有记录或备份规则已变化时执行完整遍历。
+    目录修改时间只反映条目的增删和改名，原地改写的文件需要完整核对（--reconcile）才能发现。
+    :param root: WeChat 容器根目录
+    :param target_dir: 备份目标目录
+    :param base_wechat_dir: WeChat 文件夹的根目录
+    :param scheduler: 可选的 CopyScheduler 实例
+    :param matcher: 预编译的 RuleMatcher，为 None 时按当前配置获取
+    :param full: 为 True 时总是完整遍历
+    :return: 重新读取的目录数，完整遍历时返回 None
+    """
+    root = os.path.abspath(root)
+    matcher = matcher or get_matcher()
+    signature = matcher.signature()
+    known = {} if full else list_dir_states(root)
+    if not known or get_config("dir_state_rules") != signature:
+        if not full:
+            logging.info("没有可用的目录状态记录或备份规则已变化，完整遍历目录")
+        full_sync(root, target_dir, base_wechat_dir, scheduler, matcher)
+        # 目录状态全部提交后才记录规则，中途退出时下次仍会完整遍历
+        flush()
+        if get_config("dir_state_rules") != signature:
+            set_config("dir_state_rules", signature)
+        return None
+
+    start = time.perf_counter()
+    changed = []
+    for dir_path, (mtime_ns, _) in known.items():
+        try:
+            current = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            remove_dir_states(dir_path)
+            continue
+        except OSError as e:
+            logging.warning(f"无法读取目录 {dir_path}: {e}")
+            continue
+        if current != mtime_ns:
+            changed.append(dir_path)
+
+    stats = WalkStats()
+    for dir_path in changed:
+        # 已记录的子目录各自核对，这里只进入新出现的子目录
+        stats.merge(process_directory(dir_path, target_dir, base_wechat_dir, scheduler, matcher, skip_dirs=known))
+    stats.log_summary(f"启动核对：检查 {len(known)} 个目录，重新读取 {len(changed)} 个，"
+                      f"耗时 {time.perf_counter() - start:.2f} 秒")
+    return len(changed)
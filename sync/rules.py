@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+
+from .config_store import get_config, get_config_version
+
+DEFAULT_FILE_TYPES = '[".jpg", ".png", ".mp4", ".mov"]'
+
+
+class RuleMatcher:
+    """
+    预编译的备份规则：包含/排除目录名集合与扩展名集合。
+    目录规则：没有包含规则时所有目录都匹配；否则路径中需要出现某个包含目录名，且不能出现任何排除目录名。
+    目录名和扩展名的比较都不区分大小写，与 macOS 默认不区分大小写的文件系统一致，
+    因此规则中的 "image" 也会匹配 Image 目录，".JPG" 与 ".jpg" 等价。
+    """
+
+    def __init__(self, include_dirs, exclude_dirs, file_types, version=None):
+        """
+        :param include_dirs: 包含规则列表
+        :param exclude_dirs: 排除规则列表
+        :param file_types: 需要备份的扩展名列表，例如 [".jpg", ".mp4"]
+        :param version: 构建时的配置版本号
+        """
+        self.includes = frozenset(name.lower() for name in include_dirs)
+        self.excludes = frozenset(name.lower() for name in exclude_dirs)
+        self.suffixes = frozenset(
+            ext if ext.startswith(".") else f".{ext}"
+            for ext in (ext.strip().lower() for ext in file_types) if ext
+        )
+        self.version = version
+
+    @classmethod
+    def from_config(cls):
+        """根据数据库中的当前配置构建匹配器"""
+        version = get_config_version()
+        return cls(
+            json.loads(get_config("include_dirs", "[]")),
+            json.loads(get_config("exclude_dirs", "[]")),
+            json.loads(get_config("file_types", DEFAULT_FILE_TYPES)),
+            version,
+        )
+
+    def signature(self):
+        """规则内容的稳定表示，与配置版本号无关，可持久化后用于判断规则是否变化"""
+        return json.dumps([sorted(self.includes), sorted(self.excludes), sorted(self.suffixes)])
+
+    def match_file_type(self, file_name):
+        """文件扩展名是否属于需要备份的类型"""
+        return os.path.splitext(file_name)[1].lower() in self.suffixes
+
+    def is_included_name(self, dir_name):
+        """目录名本身是否命中包含规则"""
+        return dir_name.lower() in self.includes
+
+    def should_prune(self, dir_name):
+        """
+        是否可以跳过整个子目录而不必进入。
+        只有存在包含规则时排除规则才生效，此时路径中出现排除目录名的文件都不会被备份。
+        """
+        return bool(self.includes) and dir_name.lower() in self.excludes
+
+    def match_directory(self, dir_path):
+        """判断目录路径是否符合目录规则"""
+        if not self.includes:
+            return True
+        components = {part.lower() for part in os.path.abspath(dir_path).split(os.sep)}
+        if components.isdisjoint(self.includes):
+            return False
+        return components.isdisjoint(self.excludes)
+
+    def match_file(self, file_path):
+        """判断文件是否同时符合扩展名规则和目录规则"""
+        return self.match_file_type(file_path) and self.match_directory(os.path.dirname(file_path))
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """返回与当前配置版本一致的匹配器，配置变化后才重新构建"""
+    global _matcher
+    version = get_config_version()
+    matcher = _matcher
+    if matcher is not None and matcher.version == version:
+        return matcher
+    with _matcher_lock:
+        if _matcher is None or _matcher.version != version:
+            _matcher = RuleMatcher.from_config()
+        return _matcher
@@ -0,0 +1,153 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .config_store import find_blobs_by_size, flush, get_config, get_manifest
+from .dedup_store import get_partial_hash
+from .file_copy import large_file_threshold
+from .hashing import current_algorithm, hash_file
+from .rules import get_matcher
+from .sync_logic import dispatch_backup, process_directory, save_dir_states
+from . import work_journal
+from .walker import WalkStats, iter_candidate_files
+
+# 容器内的会话目录位于 <版本>/<账号>/Message/MessageTemp/<会话>，
+# 该层级的目录各自作为一个递归分片，更浅的目录只处理直接存放的文件
+SHARD_DEPTH = 5
+
+
+def sync_workers():
+    """全量同步使用的进程数，不大于 1 时在当前进程中遍历"""
+    return int(get_config("sync_workers", str(os.cpu_count() or 1)))
+
+
+def plan_shards(root, matcher, shard_depth=SHARD_DEPTH):
+    """
+    将目录树按账号和会话目录切分为可独立遍历的分片。
+    :param root: WeChat 容器根目录
+    :param matcher: 预编译的 RuleMatcher，被排除的子目录不会产生分片
+    :param shard_depth: 作为递归分片的目录深度
+    :return: [(目录路径, 是否递归)]
+    """
+    shards = []
+    level = [os.path.abspath(root)]
+    for _ in range(shard_depth):
+        next_level = []
+        for dir_path in level:
+            shards.append((dir_path, False))
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        try:
+                            if not entry.is_dir(follow_symlinks=False):
+                                continue
+                        except OSError:
+                            continue
+                        if not matcher.should_prune(entry.name):
+                            next_level.append(entry.path)
+            except OSError as e:
+                logging.warning(f"无法读取目录 {dir_path}: {e}")
+        level = next_level
+    shards.extend((dir_path, True) for dir_path in level)
+    return shards
+
+
+def _scan_shard(task):
+    """
+    在工作进程中遍历一个分片：过滤、对照清单跳过未变化的文件。
+    只有备份目录中已有同样大小的实体文件、需要查重时才预先计算哈希；
+    其余文件（首次同步时的大多数新文件）由主进程在复制的同时计算哈希，不额外读取一遍。
+    工作进程只读取数据库，所有写入都回到主进程完成。
+    :param task: (目录路径, 是否递归, RuleMatcher, 哈希算法, 计算完整哈希的文件大小上限)
+    :return: (WalkStats, 未变化的文件数, 目录状态列表,
+              [(源文件路径, stat 信息, (哈希算法, 部分哈希, 完整哈希) 或 None)])
+    """
+    dir_path, recursive, matcher, algorithm, full_hash_limit = task
+    stats = WalkStats()
+    unchanged = 0
+    dir_states = []
+    results = []
+    for entry in iter_candidate_files(dir_path, matcher, stats, recursive, dir_states):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if get_manifest(entry.path) == (st.st_size, st.st_mtime_ns, st.st_ino):
+            unchanged += 1
+            continue
+        results.append((entry.path, st, _prehash(entry.path, st.st_size, algorithm, full_hash_limit)))
+    return stats, unchanged, dir_states, results
+
+
+def _prehash(src_path, size, algorithm, full_hash_limit):
+    """
+    已有同样大小的实体文件时预先计算查重所需的哈希。
+    部分哈希与某个实体文件一致时才计算完整哈希；大文件由主进程在内核中复制，不在这里读取全部内容。
+    :return: (哈希算法, 部分哈希, 完整哈希)，不需要查重或读取失败时为 None
+    """
+    candidates = find_blobs_by_size(size)
+    if not candidates:
+        return None
+    try:
+        partial_hash = get_partial_hash(src_path, size, algorithm)
+        full_hash = None
+        if size < full_hash_limit and any(blob_algo == algorithm and blob_partial == partial_hash
+                                          for _, blob_partial, _, blob_algo in candidates):
+            full_hash = hash_file(src_path, algorithm)
+    except OSError:
+        return None
+    return algorithm, partial_hash, full_hash
+
+
+def sharded_full_sync(root, target_dir, base_wechat_dir, scheduler=None, workers=None, matcher=None):
+    """
+    多进程全量同步：各分片的遍历、过滤和查重哈希在进程池中并行完成，
+    结果交回主进程登记持久化队列并提交备份，数据库只由主进程写入。
+    :param root: 同步的根目录
+    :param target_dir: 备份目标目录
+    :param base_wechat_dir: WeChat 文件夹的根目录
+    :param scheduler: 可选的 CopyScheduler 实例
+    :param workers: 进程数，为 None 时按配置
+    :param matcher: 预编译的 RuleMatcher，为 None 时按当前配置获取
+    :return: 合并后的 WalkStats
+    """
+    matcher = matcher or get_matcher()
+    workers = workers or sync_workers()
+    algorithm = current_algorithm()
+    full_hash_limit = large_file_threshold()
+    shards = plan_shards(root, matcher)
+    # 工作进程通过自己的连接读取清单，先提交本进程中尚未写入的记录
+    flush()
+
+    stats = WalkStats()
+    unchanged = 0
+    # 使用 spawn 启动，避免 fork 继承数据库连接和后台线程
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)) or 1, mp_context=context) as pool:
+        futures = [pool.submit(_scan_shard, (dir_path, recursive, matcher, algorithm, full_hash_limit))
+                   for dir_path, recursive in shards]
+        for future in as_completed(futures):
+            shard_stats, shard_unchanged, dir_states, results = future.result()
+            stats.merge(shard_stats)
+            unchanged += shard_unchanged
+            for src_path, st, hashes in results:
+                work_journal.discover(src_path)
+                dispatch_backup(src_path, target_dir, base_wechat_dir, scheduler, st, hashes, journaled=True)
+            save_dir_states(dir_states)
+
+    stats.log_summary(f"{root}: {len(shards)} 个分片, {workers} 个进程, 未变化 {unchanged} 个文件")
+    return stats
+
+
+def full_sync(root, target_dir, base_wechat_dir, scheduler=None, matcher=None):
+    """
+    全量同步入口：按 sync_workers 配置选择多进程分片遍历或单进程遍历。
+    :return: 本次遍历的 WalkStats
+    """
+    workers = sync_workers()
+    if workers > 1:
+        return sharded_full_sync(root, target_dir, base_wechat_dir, scheduler, workers, matcher)
+    stats = process_directory(root, target_dir, base_wechat_dir, scheduler, matcher)
+    stats.log_summary(root)
+    return stats
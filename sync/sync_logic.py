@@ -1,123 +1,296 @@
-import json
+import logging
 import os
-import hashlib
-import shutil
 
-from .config_store import get_config, set_config, get_file_hash, set_file_hash
+from .config_store import get_file_hash, set_file_hash, get_manifest, set_manifest, set_dir_state
+from .dedup_store import DedupStore
+from .file_copy import copy_large_file, copy_with_hash, discard_partial, large_file_threshold
+from .hashing import current_algorithm, new_hasher
+from .pack_store import get_pack_store, pack_file_max_size, target_mode
+from .rules import get_matcher
+from . import work_journal
+from .walker import WalkStats, iter_candidate_files
+from .metrics import (FILES_SEEN, FILES_SKIPPED, FILES_DEDUPED, FILES_COPIED, FILES_FAILED,
+                      BYTES_COPIED, COPY_SECONDS, get_file_logger)
 
-def save_hash(file_path, file_hash):
-    """保存文件的 MD5 哈希值"""
-    set_file_hash(file_path, file_hash)
+# 逐文件日志：调试级别并且限流
+file_log = get_file_logger()
 
-def get_file_md5(file_path):
-    """获取文件的 MD5 哈希值"""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+dedup_store = DedupStore()
 
 def is_duplicate(file_path):
-    """检查文件是否重复"""
-    file_hash = get_file_hash(file_path)
-    if file_hash:
-        return True
-    save_hash(file_path, get_file_md5(file_path))
-    return False
+    """检查该源文件路径是否已经备份过"""
+    return bool(get_file_hash(file_path))
 
-def match_directory_rule(file_path, include_dirs, exclude_dirs):
+def is_unchanged(file_path, st):
     """
-    判断文件路径是否符合目录规则。
-    :param file_path: 文件路径
-    :param include_dirs: 包含规则列表
-    :param exclude_dirs: 排除规则列表
-    :return: 是否匹配规则
+    仅根据 stat 信息判断源文件自上次备份后是否未变化，无需读取文件内容。
+    :param file_path: 源文件路径
+    :param st: 源文件的 os.stat_result
     """
-    if not include_dirs:
-        return True
-    
-    file_dirs = os.path.abspath(file_path).split(os.sep)
-    
-    for include_dir in include_dirs:
-        if include_dir in file_dirs:
-            for exclude_dir in exclude_dirs:
-                if exclude_dir in file_dirs:
-                    return False
-            return True
-    
-    return False
+    return get_manifest(file_path) == (st.st_size, st.st_mtime_ns, st.st_ino)
+
+def record_manifest(file_path, st):
+    """记录源文件备份时的 stat 信息"""
+    set_manifest(file_path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+def save_dir_states(dir_states):
+    """
+    记录遍历时各目录的状态，供下次启动时核对。
+    与文件登记使用同一个批量写入队列，提交时一定排在这些目录中发现的文件之后。
+    :param dir_states: [(目录路径, 修改时间, 条目数)]
+    """
+    for dir_path, mtime_ns, entry_count in dir_states:
+        set_dir_state(dir_path, mtime_ns, entry_count)
 
 def should_backup(file_path):
     """判断文件是否需要备份"""
-    file_types = json.loads(get_config("file_types", '[".jpg", ".png", ".mp4", ".mov"]'))
-
-    if not any(file_path.endswith(ext.strip()) for ext in file_types):
-        print(f"跳过非备份文件类型: {file_path}")
+    if not get_matcher().match_file_type(file_path):
+        file_log.debug(f"跳过非备份文件类型: {file_path}")
         return False
     
     return True
 
-def backup_file(src_path, target_dir, base_wechat_dir):
+def backup_file(src_path, target_dir, base_wechat_dir, st=None, hashes=None, journaled=False):
     """
     统一处理文件备份逻辑，包括去重和日志输出。
+    已登记到持久化队列的文件在备份完成或确认无需备份后移出队列，出错的文件留在队列中，下次启动时重试。
     :param src_path: 源文件路径
     :param target_dir: 备份目标目录
     :param base_wechat_dir: WeChat 文件夹的根目录
+    :param st: 已获取的源文件 stat 信息，未提供时重新获取
+    :param hashes: 已预先计算的 (哈希算法, 部分哈希, 完整哈希)
+    :param journaled: 文件是否已登记到持久化队列，未登记的文件处理后不需要移出
+    """
+    if _backup_file(src_path, target_dir, base_wechat_dir, st, hashes, journaled) and journaled:
+        work_journal.finish(src_path)
+
+def _has_legacy_copy(src_path, target_subdir, st):
+    """
+    旧版本在复制之前就写入了哈希记录，复制中断或失败的文件同样有记录。
+    只有目标文件存在且大小和修改时间（shutil.copy2 会保留）与源文件一致时才认为已备份。
+    """
+    try:
+        target_st = os.stat(os.path.join(target_subdir, os.path.basename(src_path)))
+    except OSError:
+        return False
+    return (target_st.st_size, target_st.st_mtime_ns) == (st.st_size, st.st_mtime_ns)
+
+def _backup_file(src_path, target_dir, base_wechat_dir, st=None, hashes=None, journaled=False):
+    """
+    backup_file 的实现，只有已登记到持久化队列的文件才推进其处理状态。
+    :return: 是否已处理完毕（备份成功或无需备份），出错时返回 False
     """
     filename = os.path.basename(src_path)
     relative_path = os.path.relpath(os.path.dirname(src_path), base_wechat_dir)
     target_subdir = os.path.join(target_dir, relative_path)
+    FILES_SEEN.inc()
     
     if not should_backup(src_path):
-        print(f"跳过不符合备份条件的文件: {filename}")
-        return
+        FILES_SKIPPED.labels(reason="file_type").inc()
+        return True
     
-    if is_duplicate(src_path):
-        print(f"跳过重复文件: {filename}")
-        return
+    try:
+        st = st or os.stat(src_path)
+    except OSError as e:
+        FILES_SKIPPED.labels(reason="stat_error").inc()
+        file_log.debug(f"无法读取文件信息 {filename}: {e}")
+        return True
+
+    if is_unchanged(src_path, st):
+        FILES_SKIPPED.labels(reason="unchanged").inc()
+        file_log.debug(f"跳过未变化文件: {filename}")
+        return True
+
+    if is_duplicate(src_path) and get_manifest(src_path) is None and _has_legacy_copy(src_path, target_subdir, st):
+        # 旧版本只按路径记录了哈希，副本完整时补录清单后跳过
+        record_manifest(src_path, st)
+        FILES_SKIPPED.labels(reason="legacy_hash").inc()
+        file_log.debug(f"跳过重复文件: {filename}")
+        return True
     
+    if target_mode() == "packed" and st.st_size < pack_file_max_size():
+        return backup_packed(src_path, target_dir, os.path.join(relative_path, filename), st)
+
     # 确保只有在需要备份文件时才创建目录
     os.makedirs(target_subdir, exist_ok=True)
     target_path = os.path.join(target_subdir, filename)
     
     try:
-        shutil.copy2(src_path, target_path)
-        print(f"已备份文件: {filename} -> {target_path}")
+        size = st.st_size
+        with dedup_store.size_lock(size):
+            blob_path, partial_hash, full_hash, hash_algo = dedup_store.find_duplicate(src_path, size, hashes)
+            if partial_hash is not None and journaled:
+                work_journal.mark(src_path, work_journal.HASHED)
+            if blob_path:
+                with COPY_SECONDS.labels(method="link").time():
+                    method = dedup_store.link(blob_path, target_path)
+                if journaled:
+                    work_journal.mark(src_path, work_journal.COPIED)
+                set_file_hash(src_path, full_hash, hash_algo)
+                record_manifest(src_path, st)
+                FILES_DEDUPED.inc()
+                file_log.debug(f"内容重复，已链接文件({method}): {filename} -> {target_path}")
+                return True
+
+            if size >= large_file_threshold():
+                # 大文件在内核中复制并可断点续传，不在复制时计算哈希，
+                # 完整哈希留到查重需要时再计算
+                with COPY_SECONDS.labels(method="zero_copy").time():
+                    copied_bytes = copy_large_file(src_path, target_path, st)
+            else:
+                if os.path.lexists(target_path):
+                    # 目标可能是硬链接，先解除链接再写入，避免改写其他路径的内容
+                    os.remove(target_path)
+                # 复制的同时计算哈希，复制成功后才登记哈希记录
+                with COPY_SECONDS.labels(method="copy").time():
+                    copied_hash = copy_with_hash(src_path, target_path,
+                                                 new_hasher(hash_algo) if full_hash is None else None)
+                full_hash = full_hash or copied_hash
+                copied_bytes = size
+            if journaled:
+                work_journal.mark(src_path, work_journal.COPIED)
+            dedup_store.record(target_path, size, partial_hash, full_hash, hash_algo)
+            if full_hash is not None:
+                set_file_hash(src_path, full_hash, hash_algo)
+            record_manifest(src_path, st)
+        FILES_COPIED.inc()
+        BYTES_COPIED.inc(copied_bytes)
+        file_log.debug(f"已备份文件: {filename} -> {target_path}")
+        return True
     except Exception as e:
-        print(f"备份文件 {filename} 时出错: {e}")
+        FILES_FAILED.inc()
+        logging.error(f"备份文件 {filename} 时出错: {e}")
+        return False
 
-def process_directory_matched(source_dir, target_dir, base_wechat_dir):
+def backup_packed(src_path, target_dir, rel_path, st):
     """
-    递归处理符合条件的子文件夹。
-    :param source_dir: 当前处理的源目录
+    打包模式：将小文件追加到备份目录的包文件中。
+    :param src_path: 源文件路径
+    :param target_dir: 备份目标目录
+    :param rel_path: 相对备份目录的路径
+    :param st: 源文件的 stat 信息
+    :return: 是否成功
+    """
+    filename = os.path.basename(src_path)
+    try:
+        with COPY_SECONDS.labels(method="pack").time():
+            method = get_pack_store(target_dir).add(rel_path, src_path, st)
+        record_manifest(src_path, st)
+        if method == "dedup":
+            FILES_DEDUPED.inc()
+            file_log.debug(f"内容重复，已登记到包内已有数据: {filename}")
+        else:
+            FILES_COPIED.inc()
+            BYTES_COPIED.inc(st.st_size)
+            file_log.debug(f"已打包文件: {filename} -> {rel_path}")
+        return True
+    except Exception as e:
+        FILES_FAILED.inc()
+        logging.error(f"打包文件 {filename} 时出错: {e}")
+        return False
+
+def dispatch_backup(src_path, target_dir, base_wechat_dir, scheduler=None, st=None, hashes=None, journaled=False):
+    """
+    备份单个文件，提供调度器时交给调度器并发执行。
+    :param scheduler: CopyScheduler 实例，为 None 时在当前线程同步备份
+    :param st: 已获取的源文件 stat 信息
+    :param hashes: 已预先计算的 (哈希算法, 部分哈希, 完整哈希)
+    :param journaled: 文件是否已登记到持久化队列
+    """
+    if scheduler is not None:
+        scheduler.submit(src_path, st, hashes=hashes, journaled=journaled)
+    else:
+        backup_file(src_path, target_dir, base_wechat_dir, st, hashes, journaled)
+
+def process_file(src_path, target_dir, base_wechat_dir, scheduler=None):
+    """
+    处理文件事件登记到持久化队列中的单个文件：先按目录规则过滤，再交给 backup_file。
+    :param src_path: 源文件路径
     :param target_dir: 备份目标目录
     :param base_wechat_dir: WeChat 文件夹的根目录
+    :param scheduler: 可选的 CopyScheduler 实例
     """
-    for item in os.listdir(source_dir):
-        item_path = os.path.join(source_dir, item)
+    if not get_matcher().match_file(src_path):
+        work_journal.finish(src_path)
+        return
 
-        if os.path.isdir(item_path):
-            process_directory_matched(item_path, target_dir, base_wechat_dir)
-        else:
-            backup_file(item_path, target_dir, base_wechat_dir)
+    dispatch_backup(src_path, target_dir, base_wechat_dir, scheduler, journaled=True)
 
-def process_directory(root, target_dir, base_wechat_dir):
+def process_directory(root, target_dir, base_wechat_dir, scheduler=None, matcher=None, skip_dirs=None):
     """
-    递归处理符合条件的子文件夹。
+    遍历目录树并备份所有候选文件，被排除的子目录整体跳过，不再进入。
+    遍历过的目录状态会被记录，供下次启动时核对。
     :param root: 当前处理的根目录
     :param target_dir: 备份目标目录
-    :param config: 配置信息
     :param base_wechat_dir: WeChat 文件夹的根目录
+    :param scheduler: 可选的 CopyScheduler 实例
+    :param matcher: 预编译的 RuleMatcher，为 None 时按当前配置获取
+    :param skip_dirs: 不进入的子目录路径集合
+    :return: 本次遍历的 WalkStats
     """
-    include_dirs = json.loads(get_config("include_dirs", "[]"))
-    exclude_dirs = json.loads(get_config("exclude_dirs", "[]"))
+    stats = WalkStats()
+    dir_states = []
+    for entry in iter_candidate_files(root, matcher or get_matcher(), stats,
+                                      dir_states=dir_states, skip_dirs=skip_dirs):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if is_unchanged(entry.path, st):
+            # 未变化的文件不进入持久化队列也不提交备份，不产生额外写入
+            continue
+        work_journal.discover(entry.path)
+        dispatch_backup(entry.path, target_dir, base_wechat_dir, scheduler, st, journaled=True)
+    save_dir_states(dir_states)
 
-    for item in os.listdir(root):
-        item_path = os.path.join(root, item)
-        
-        if os.path.isdir(item_path):
-            if match_directory_rule(item_path, include_dirs, exclude_dirs):
-                process_directory_matched(item_path, target_dir, base_wechat_dir)
-            else:
-                process_directory(item_path, target_dir, base_wechat_dir)
-                print(f"跳过不符合目录规则的子文件夹: {item_path}")
\ No newline at end of file
+    # 核对和新目录会逐个目录调用，汇总由调用方按整次遍历输出
+    stats.log_summary(root, logging.DEBUG)
+    return stats
+
+def resume_pending_work(target_dir, base_wechat_dir, scheduler=None):
+    """
+    继续处理上次运行结束时仍在持久化队列中的文件。
+    源文件已被删除或停止期间规则变化后不再需要备份的文件直接移出队列，并删除其未完成复制的临时文件。
+    已复制但尚未登记的文件，如果备份目录中的副本与源文件一致，直接补登记，不再复制。
+    :return: 重新处理的文件数
+    """
+    pending = work_journal.pending_work()
+    if pending:
+        logging.info(f"继续处理上次未完成的 {len(pending)} 个文件")
+    matcher = get_matcher()
+    for src_path, state in pending:
+        if not matcher.match_file(src_path):
+            _drop_pending(src_path, target_dir, base_wechat_dir)
+            continue
+        try:
+            st = os.stat(src_path)
+        except FileNotFoundError:
+            _drop_pending(src_path, target_dir, base_wechat_dir)
+            continue
+        except OSError as e:
+            logging.warning(f"无法读取文件信息 {src_path}: {e}")
+            continue
+        if state == work_journal.COPIED and _adopt_copied(src_path, target_dir, base_wechat_dir, st):
+            continue
+        dispatch_backup(src_path, target_dir, base_wechat_dir, scheduler, st, journaled=True)
+    return len(pending)
+
+def _drop_pending(src_path, target_dir, base_wechat_dir):
+    """将不再需要备份的文件移出队列，大文件复制中断留下的临时文件不会再被续传，一并删除"""
+    discard_partial(src_path, os.path.join(target_dir, os.path.relpath(src_path, base_wechat_dir)))
+    work_journal.finish(src_path)
+
+def _adopt_copied(src_path, target_dir, base_wechat_dir, st):
+    """复制已完成但登记前中断时，按大小和修改时间确认副本完整后补登记"""
+    target_path = os.path.join(target_dir, os.path.relpath(src_path, base_wechat_dir))
+    try:
+        target_st = os.stat(target_path)
+    except OSError:
+        return False
+    if (target_st.st_size, target_st.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+        return False
+    with dedup_store.size_lock(st.st_size):
+        dedup_store.record(target_path, st.st_size, None, None, current_algorithm())
+        record_manifest(src_path, st)
+    work_journal.finish(src_path)
+    return True
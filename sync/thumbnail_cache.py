@@ -0,0 +1,77 @@
+import hashlib
+import logging
+import os
+import threading
+
+from PIL import Image
+
+from .config_store import DB_DIR
+
+# 头像网格中使用的缩略图尺寸
+THUMBNAIL_SIZE = (100, 100)
+
+CACHE_DIR = os.path.join(DB_DIR, "thumbnails")
+
+
+class ThumbnailCache:
+    """
+    磁盘缩略图缓存：以 (路径, 文件大小, 修改时间, 尺寸) 为键保存已缩放好的缩略图，
+    源文件变化后键随之变化，旧缓存自然失效。
+    缓存未命中时对 JPEG 使用 draft 模式按比例降采样解码，只解出接近目标尺寸的像素。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, size=THUMBNAIL_SIZE):
+        """
+        :param cache_dir: 缓存目录
+        :param size: 缩略图尺寸 (宽, 高)
+        """
+        self.cache_dir = cache_dir
+        self.size = size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, path, st):
+        """返回源文件对应的缓存文件路径"""
+        raw = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{self.size[0]}x{self.size[1]}"
+        key = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def load(self, path):
+        """
+        获取缩略图，优先从磁盘缓存读取。
+        :param path: 源图片路径
+        :return: 已加载到内存的 PIL.Image
+        """
+        st = os.stat(path)
+        cached = self.cache_path(path, st)
+        if os.path.exists(cached):
+            try:
+                with Image.open(cached) as img:
+                    img.load()
+                    return img.copy()
+            except OSError:
+                logging.warning(f"缩略图缓存损坏，重新生成: {cached}")
+
+        img = self.render(path)
+        self._store(cached, img)
+        return img
+
+    def render(self, path):
+        """解码源图片并缩放到缩略图尺寸"""
+        with Image.open(path) as img:
+            if img.format == "JPEG":
+                # 让解码器直接按 1/2、1/4、1/8 缩小解码
+                img.draft("RGB", self.size)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+            return img.resize(self.size)
+
+    def _store(self, cached, img):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_path = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmp_path, "PNG", compress_level=1)
+            os.replace(tmp_path, cached)
+        except OSError as e:
+            logging.warning(f"写入缩略图缓存失败 {cached}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
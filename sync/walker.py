@@ -0,0 +1,130 @@
+import heapq
+import logging
+import os
+import time
+
+# 扫描耗时超过该值（秒）的目录会输出调试日志
+SLOW_DIRECTORY_SECONDS = 0.05
+
+# 修改时间距扫描时刻不足该值（纳秒）的目录，在粗粒度时间戳的文件系统上可能在扫描后
+# 再次变化而修改时间不变，记录的状态以 0 代替，下次核对时一定重新扫描
+RACY_MTIME_NS = 2 * 1000 ** 3
+
+
+class WalkStats:
+    """目录遍历统计：目录数、候选文件数以及耗时最长的目录"""
+
+    def __init__(self, keep_slowest=20):
+        self.dirs = 0
+        self.entries = 0
+        self.candidates = 0
+        self.pruned = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest = []  # 小顶堆 (耗时, 目录, 条目数)
+
+    def record_directory(self, dir_path, elapsed, entry_count):
+        self.dirs += 1
+        self.entries += entry_count
+        self.elapsed += elapsed
+        item = (elapsed, dir_path, entry_count)
+        if len(self.slowest) < self.keep_slowest:
+            heapq.heappush(self.slowest, item)
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+        if elapsed >= SLOW_DIRECTORY_SECONDS:
+            logging.debug(f"扫描目录 {dir_path}: {entry_count} 项, 耗时 {elapsed * 1000:.2f} ms")
+
+    def merge(self, other):
+        """合并另一次遍历（例如其他进程中的分片）的统计"""
+        self.dirs += other.dirs
+        self.entries += other.entries
+        self.candidates += other.candidates
+        self.pruned += other.pruned
+        self.errors += other.errors
+        self.elapsed += other.elapsed
+        for item in other.slowest:
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, item)
+            elif item[0] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def slowest_directories(self):
+        """按耗时从高到低返回 [(耗时, 目录, 条目数)]"""
+        return sorted(self.slowest, reverse=True)
+
+    def summary(self):
+        return (f"扫描 {self.dirs} 个目录、{self.entries} 项，候选文件 {self.candidates} 个，"
+                f"跳过子目录 {self.pruned} 个，出错 {self.errors} 次，目录扫描耗时 {self.elapsed:.2f} 秒")
+
+    def log_summary(self, label, level=logging.INFO):
+        """输出一次遍历的汇总以及扫描最慢的几个目录"""
+        logging.log(level, f"{label}: {self.summary()}")
+        for elapsed, dir_path, entry_count in self.slowest_directories()[:5]:
+            logging.log(level, f"扫描较慢的目录 {dir_path}: {entry_count} 项, 耗时 {elapsed * 1000:.1f} ms")
+
+
+def iter_candidate_files(root, matcher, stats=None, recursive=True, dir_states=None, skip_dirs=None):
+    """
+    基于 os.scandir 的迭代式目录遍历，逐个产出需要备份的候选文件。
+    使用 DirEntry 缓存的类型信息判断目录和文件，不跟随符号链接；
+    被排除的子目录整体跳过，不符合扩展名的文件不会被 stat。
+    :param root: 遍历的根目录，根目录下直接存放的文件同样会被处理
+    :param matcher: 预编译的 RuleMatcher
+    :param stats: 可选的 WalkStats，用于记录每个目录的扫描耗时
+    :param recursive: 为 False 时只处理根目录下直接存放的文件
+    :param dir_states: 可选的列表，追加每个已扫描目录的 (目录路径, 修改时间, 条目数)
+    :param skip_dirs: 不进入的子目录路径集合（例如已单独处理的目录）
+    :return: 产出 os.DirEntry 的生成器
+    """
+    root = os.path.abspath(root)
+    if matcher.includes:
+        components = {part.lower() for part in root.split(os.sep)}
+        if not components.isdisjoint(matcher.excludes):
+            return
+        root_included = not components.isdisjoint(matcher.includes)
+    else:
+        root_included = True
+
+    stack = [(root, root_included)]
+    while stack:
+        dir_path, included = stack.pop()
+        start = time.perf_counter()
+        candidates = []
+        entry_count = 0
+        try:
+            if dir_states is not None:
+                # 先于读取目录获取修改时间，扫描期间的变化会在下次核对时被发现
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    entry_count += 1
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if is_dir:
+                        if not recursive or (skip_dirs is not None and entry.path in skip_dirs):
+                            continue
+                        if matcher.should_prune(entry.name):
+                            if stats is not None:
+                                stats.pruned += 1
+                            continue
+                        stack.append((entry.path, included or matcher.is_included_name(entry.name)))
+                    elif included and matcher.match_file_type(entry.name):
+                        candidates.append(entry)
+        except OSError as e:
+            logging.warning(f"无法读取目录 {dir_path}: {e}")
+            if stats is not None:
+                stats.errors += 1
+            continue
+
+        if stats is not None:
+            stats.record_directory(dir_path, time.perf_counter() - start, entry_count)
+            stats.candidates += len(candidates)
+        if dir_states is not None:
+            if time.time_ns() - mtime_ns < RACY_MTIME_NS:
+                mtime_ns = 0
+            dir_states.append((dir_path, mtime_ns, entry_count))
+        yield from candidates
@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+
+from .config_store import list_dir_states
+from .rules import get_matcher
+
+try:
+    from watchdog.observers.fsevents import FSEventsObserver
+except ImportError:
+    # 非 macOS 平台没有 FSEvents 后端
+    FSEventsObserver = None
+
+
+def _is_pruned(root, dir_path, matcher):
+    """目录相对根目录的路径中是否有被排除的目录名（规则变化后目录状态中可能仍有这类目录）"""
+    return dir_path != root and any(matcher.should_prune(name)
+                                    for name in os.path.relpath(dir_path, root).split(os.sep))
+
+
+def should_watch(root, dir_path, matcher):
+    """新出现的目录是否需要递归监听：未被排除且命中包含规则"""
+    return not _is_pruned(root, dir_path, matcher) and matcher.match_directory(dir_path)
+
+
+def is_covered(recursive_dirs, root, path):
+    """
+    路径是否位于某个递归监听的目录之下（不含该目录本身）。
+    :param recursive_dirs: 递归监听的目录路径集合
+    """
+    parent = os.path.dirname(path)
+    while len(parent) >= len(root):
+        if parent in recursive_dirs:
+            return True
+        if parent == root:
+            break
+        parent = os.path.dirname(parent)
+    return False
+
+
+def plan_watches(root, dir_paths, matcher):
+    """
+    根据备份规则计算需要监听的目录。
+    没有包含规则时任何目录都可能有需要备份的文件，递归监听根目录；
+    否则递归监听命中包含规则的最上层目录，并对其父目录（例如 Message/MessageTemp）做非递归监听，
+    用于发现新建的会话目录。其他祖先目录（账号目录、存放聊天数据库的 Message 目录等）不监听，
+    这些目录中数据库、日志文件的频繁写入不会产生文件事件。
+    :param root: WeChat 容器根目录
+    :param dir_paths: 已知的目录路径（通常来自上次遍历记录的目录状态）
+    :param matcher: 预编译的 RuleMatcher
+    :return: {目录路径: 是否递归}
+    """
+    root = os.path.abspath(root)
+    if not matcher.includes or matcher.match_directory(root) or not dir_paths:
+        # 没有已知目录时（尚未完成过遍历）同样只能递归监听根目录
+        return {root: True}
+
+    plan = {}
+    recursive = set()
+    # 按深度排序，处理子目录时其祖先目录是否已递归监听已经确定
+    for dir_path in sorted(dir_paths, key=lambda path: path.count(os.sep)):
+        if dir_path == root or _is_pruned(root, dir_path, matcher):
+            continue
+        if is_covered(recursive, root, dir_path):
+            continue
+        if matcher.match_directory(dir_path):
+            plan[dir_path] = True
+            recursive.add(dir_path)
+            plan.setdefault(os.path.dirname(dir_path), False)
+    if not recursive:
+        # 包含的目录尚未出现，只能递归监听根目录等待其出现
+        return {root: True}
+    return plan
+
+
+class _PrefixFilter:
+    """FSEvents 单一递归流的事件过滤：只转发位于监听集合内的事件"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def dispatch(self, event):
+        paths = (event.src_path, getattr(event, "dest_path", ""))
+        if any(path and self.manager.accepts(path) for path in paths):
+            self.manager.handler.dispatch(event)
+
+
+class WatchManager:
+    """
+    维护 Observer 上的监听集合：按当前规则计算需要监听的目录，增删与上次不同的监听。
+    FSEvents 后端的非递归监听实际上是整棵子树的递归流再在 Python 中过滤，叠加多个监听时同一事件会被重复处理，
+    因此该后端只在根目录上建立一个递归流，按监听集合过滤事件路径。
+    """
+
+    def __init__(self, observer, handler, root):
+        """
+        :param observer: watchdog Observer
+        :param handler: 所有监听共用的事件处理器
+        :param root: WeChat 容器根目录
+        """
+        self.observer = observer
+        self.handler = handler
+        self.root = os.path.abspath(root)
+        self.lock = threading.Lock()
+        self.watches = {}  # dir_path -> (recursive, ObservedWatch)，FSEvents 后端没有单独的 ObservedWatch
+        self.recursive = set()  # 递归监听的目录
+        self.signature = None  # 上次计算监听集合时的规则
+        self.stream = None
+        if FSEventsObserver is not None and isinstance(observer, FSEventsObserver):
+            self.stream = observer.schedule(_PrefixFilter(self), self.root, recursive=True)
+
+    def __len__(self):
+        return len(self.watches)
+
+    def accepts(self, path):
+        """路径上的事件是否在监听集合内：位于递归监听的目录中，或是某个监听目录的直接子项"""
+        return (path in self.recursive or is_covered(self.recursive, self.root, path)
+                or os.path.dirname(path) in self.watches)
+
+    def refresh(self, force=False):
+        """
+        按当前规则和已知目录重新计算监听集合。
+        :param force: 为 False 时规则未变化则不重新计算
+        :return: 新增的递归监听目录列表
+        """
+        matcher = get_matcher()
+        signature = matcher.signature()
+        with self.lock:
+            if not force and signature == self.signature:
+                return []
+            self.signature = signature
+            dir_paths = list_dir_states(self.root) if matcher.includes else ()
+            plan = plan_watches(self.root, dir_paths, matcher)
+
+            for dir_path, (recursive, watch) in list(self.watches.items()):
+                if plan.get(dir_path) != recursive:
+                    self._unschedule(dir_path, watch)
+            added = []
+            for dir_path, recursive in plan.items():
+                if dir_path not in self.watches and self._schedule(dir_path, recursive) and recursive:
+                    added.append(dir_path)
+
+        logging.info(f"监听 {len(self.watches)} 个目录，其中递归监听 {len(self.recursive)} 个")
+        return added
+
+    def add_directory(self, dir_path):
+        """
+        文件事件：出现了新目录。目录不在递归监听范围内且可能包含需要备份的文件时为其建立监听。
+        :return: 是否新建了监听，调用方随后应遍历该目录
+        """
+        dir_path = os.path.abspath(dir_path)
+        matcher = get_matcher()
+        with self.lock:
+            if is_covered(self.recursive, self.root, dir_path) or dir_path in self.watches:
+                return False
+            return should_watch(self.root, dir_path, matcher) and self._schedule(dir_path, True)
+
+    def remove_directory(self, dir_path):
+        """文件事件：目录被删除或移走，移除该目录及其子目录上的监听"""
+        dir_path = os.path.abspath(dir_path)
+        prefix = dir_path + os.sep
+        with self.lock:
+            for path, (_, watch) in list(self.watches.items()):
+                if path == dir_path or path.startswith(prefix):
+                    self._unschedule(path, watch)
+
+    def _schedule(self, dir_path, recursive):
+        if self.stream is not None:
+            watch = None
+        else:
+            try:
+                watch = self.observer.schedule(self.handler, dir_path, recursive=recursive)
+            except OSError as e:
+                logging.warning(f"无法监听目录 {dir_path}: {e}")
+                return False
+        self.watches[dir_path] = (recursive, watch)
+        if recursive:
+            self.recursive.add(dir_path)
+        return True
+
+    def _unschedule(self, dir_path, watch):
+        del self.watches[dir_path]
+        self.recursive.discard(dir_path)
+        if watch is None:
+            return
+        try:
+            self.observer.unschedule(watch)
+        except (KeyError, OSError):
+            # 目录被删除时监听可能已经失效
+            pass
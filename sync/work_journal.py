@@ -0,0 +1,26 @@
+from .config_store import list_work, remove_work, set_work_state
+
+# 文件在队列中的状态，依次推进；登记完成（recorded）后直接移出队列
+DISCOVERED = "discovered"
+HASHED = "hashed"
+COPIED = "copied"
+
+
+def discover(src_path):
+    """登记一个待备份的文件（目录遍历发现或收到文件事件）"""
+    set_work_state(src_path, DISCOVERED)
+
+
+def mark(src_path, state):
+    """推进文件的处理状态"""
+    set_work_state(src_path, state)
+
+
+def finish(src_path):
+    """文件已备份并登记，或确认无需备份，移出队列"""
+    remove_work(src_path)
+
+
+def pending_work():
+    """返回上次运行未处理完的文件 [(src_path, state)]"""
+    return list_work()
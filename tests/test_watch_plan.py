@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+# 导入 sync 包时会打开数据库，测试中使用临时目录
+os.environ.setdefault("WECHAT_BACKUP_HOME", tempfile.mkdtemp(prefix="wechat_backup_test_"))
+
+from sync.rules import RuleMatcher
+from sync.watch_plan import plan_watches, should_watch
+
+ROOT = "/container"
+ACCOUNT = os.path.join(ROOT, "2.0b4.0.9", "account1")
+MESSAGE = os.path.join(ACCOUNT, "Message")
+MESSAGE_TEMP = os.path.join(MESSAGE, "MessageTemp")
+CHAT = os.path.join(MESSAGE_TEMP, "chat1")
+
+KNOWN_DIRS = [
+    ROOT,
+    os.path.dirname(ACCOUNT),
+    ACCOUNT,
+    os.path.join(ACCOUNT, "Avatar"),
+    os.path.join(ACCOUNT, "Contact"),
+    os.path.join(ACCOUNT, "Group"),
+    MESSAGE,
+    MESSAGE_TEMP,
+    CHAT,
+    os.path.join(CHAT, "Image"),
+    os.path.join(CHAT, "Video"),
+    os.path.join(MESSAGE_TEMP, "chat2"),
+    os.path.join(MESSAGE_TEMP, "chat2", "Image"),
+]
+
+
+def _matcher(include_dirs):
+    return RuleMatcher(include_dirs, [], [".jpg", ".mp4"])
+
+
+def test_included_chat_watched_recursively_with_parent():
+    plan = plan_watches(ROOT, KNOWN_DIRS, _matcher(["chat1"]))
+    assert plan == {CHAT: True, MESSAGE_TEMP: False}
+
+
+def test_database_directories_not_watched():
+    plan = plan_watches(ROOT, KNOWN_DIRS, _matcher(["chat1"]))
+    for dir_path in (ROOT, ACCOUNT, MESSAGE, os.path.join(ACCOUNT, "Contact"), os.path.join(ACCOUNT, "Group")):
+        assert dir_path not in plan
+
+
+def test_without_includes_watch_root_recursively():
+    assert plan_watches(ROOT, KNOWN_DIRS, _matcher([])) == {ROOT: True}
+
+
+def test_included_directory_not_seen_yet_watches_root():
+    assert plan_watches(ROOT, KNOWN_DIRS, _matcher(["chat3"])) == {ROOT: True}
+
+
+def test_new_chat_directory():
+    matcher = _matcher(["chat1", "chat3"])
+    assert should_watch(ROOT, os.path.join(MESSAGE_TEMP, "chat3"), matcher)
+    assert not should_watch(ROOT, os.path.join(MESSAGE_TEMP, "chat4"), matcher)
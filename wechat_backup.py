@@ -1,9 +1,20 @@
+import argparse
 import os
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from sync.sync_logic import process_directory
-from sync.config_store import get_config, set_config
+from sync.sync_logic import process_directory, process_file, backup_file, resume_pending_work
+from sync.rules import get_matcher
+from sync import work_journal
+from sync.event_pipeline import EventPipeline
+from sync.copy_scheduler import CopyScheduler
+from sync.reconcile import reconcile_changes
+from sync.watch_plan import WatchManager
+from sync.poll_watcher import PollingWatcher, watch_backend
+from sync.pack_store import close_pack_stores
+from sync.config_store import get_config, set_config, poll_config, remove_dir_states
+from sync.avatar_index import record_avatar_created, record_avatar_removed
+from sync import metrics
 import logging
 
 def check_folder_permission(folder_path):
@@ -19,18 +30,81 @@ def check_folder_permission(folder_path):
         return False
 
 class WeChatBackupHandler(FileSystemEventHandler):
-    def __init__(self, source_dir, target_dir, base_wechat_dir):
+    def __init__(self, source_dir, target_dir, base_wechat_dir, scheduler=None):
         self.source_dir = source_dir
         self.target_dir = target_dir
         self.base_wechat_dir = base_wechat_dir
+        self.scheduler = scheduler
+        self.watches = None  # WatchManager，建立监听后设置
+        self.pipeline = EventPipeline(
+            lambda path: process_file(path, self.target_dir, self.base_wechat_dir, self.scheduler),
+            debounce_seconds=float(get_config("event_debounce_seconds", "1.0")),
+        )
+
+    def submit(self, path):
+        """先登记到持久化队列再等待文件稳定，进程退出时尚未处理的事件不会丢失"""
+        if get_matcher().match_file(path):
+            work_journal.discover(path)
+            self.pipeline.submit(path)
+
+    def add_directory(self, dir_path):
+        """新目录出现在递归监听范围之外时，先建立监听再遍历，最后为其中已有的子目录补充监听"""
+        if self.watches is None or not self.watches.add_directory(dir_path):
+            return False
+        process_directory(dir_path, self.target_dir, self.base_wechat_dir, self.scheduler)
+        self.watches.refresh(force=True)
+        return True
 
     def on_created(self, event):
         if event.is_directory:
+            self.add_directory(event.src_path)
+            return
+        record_avatar_created(event.src_path)
+        self.submit(event.src_path)
+
+    def on_modified(self, event):
+        if event.is_directory:
+            return
+        self.submit(event.src_path)
+
+    def on_deleted(self, event):
+        record_avatar_removed(event.src_path, event.is_directory)
+        if event.is_directory:
+            remove_dir_states(event.src_path)
+            if self.watches is not None:
+                self.watches.remove_directory(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            # 整个目录被移入时，目录内的文件不会逐个产生事件
+            record_avatar_removed(event.src_path, is_directory=True)
+            record_avatar_created(event.dest_path, is_directory=True)
+            remove_dir_states(event.src_path)
+            if self.watches is not None:
+                self.watches.remove_directory(event.src_path)
+            if not self.add_directory(event.dest_path):
+                process_directory(event.dest_path, self.target_dir, self.base_wechat_dir, self.scheduler)
             return
-        src_path = event.src_path
-        process_directory(os.path.dirname(src_path), self.target_dir, self.base_wechat_dir)
+        # WeChat 先写临时文件再重命名，只备份最终路径
+        record_avatar_removed(event.src_path)
+        record_avatar_created(event.dest_path)
+        self.pipeline.discard(event.src_path)
+        self.submit(event.dest_path)
 
-def main():
+    def stop(self):
+        self.pipeline.stop()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="自动备份 WeChat 图片和视频")
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="执行一次完整核对：只复制元数据与清单不一致的文件，完成后退出",
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
     home_dir = os.path.expanduser("~")
     base_wechat_dir = os.getenv("WECHAT_DIR", os.path.join(home_dir, "Library/Containers/com.tencent.xinWeChat/Data/Library/Application Support/com.tencent.xinWeChat/"))
     backup_dir = os.path.join(home_dir, "WeChatBackup")
@@ -50,31 +124,85 @@ def main():
         print("4. 重新运行脚本。")
         return
 
+    # 逐文件日志默认关闭，排查问题时可将 file_log_level 设为 DEBUG
+    logging.getLogger("wechat_backup.files").setLevel(get_config("file_log_level", "INFO").upper())
+    metrics.start_exporter(
+        port=get_config("metrics_port"),
+        textfile=get_config("metrics_textfile"),
+        interval=float(get_config("metrics_interval", "15")),
+    )
+
     is_first_run = get_config("is_first_run", "True").lower() == "true"
+    scheduler = CopyScheduler.from_config(lambda path, st, **kwargs: backup_file(path, backup_dir, base_wechat_dir, st, **kwargs))
+    metrics.COPY_QUEUE_DEPTH.set_function(scheduler.queue_depth)
+
+    if args.reconcile:
+        print("开始完整核对...")
+        try:
+            reconcile_changes(base_wechat_dir, backup_dir, base_wechat_dir, scheduler, full=True)
+            scheduler.join()
+        finally:
+            scheduler.shutdown()
+            close_pack_stores()
+        print("完整核对完成。")
+        return
+
+    # 上次运行中断时仍在队列中的文件（包括尚未处理的文件事件）
+    resume_pending_work(backup_dir, base_wechat_dir, scheduler)
 
     if is_first_run:
         print("首次启动，开始全量同步...")
         try:
-            process_directory(base_wechat_dir, backup_dir, base_wechat_dir)
+            # 目录已完整遍历过时，剩余的文件都在持久化队列中，无需再次遍历
+            if get_config("full_sync_discovered", "False") != "True":
+                reconcile_changes(base_wechat_dir, backup_dir, base_wechat_dir, scheduler, full=True)
+                set_config("full_sync_discovered", "True")
+            scheduler.join()
+            set_config("is_first_run", "False")
+            print("全量同步完成。")
         except PermissionError as e:
             logging.error(f"权限错误：无法访问目录 {base_wechat_dir}，请检查权限设置。错误详情: {e}")
         except Exception as e:
             logging.error(f"全量同步过程中发生未知错误: {e}", exc_info=True)
 
-        set_config("is_first_run", "False")
-        print("全量同步完成。")
-
-    event_handler = WeChatBackupHandler(base_wechat_dir, backup_dir, base_wechat_dir)
-    observer = Observer()
-    observer.schedule(event_handler, base_wechat_dir, recursive=True)
+    event_handler = WeChatBackupHandler(base_wechat_dir, backup_dir, base_wechat_dir, scheduler)
+    metrics.EVENT_QUEUE_DEPTH.set_function(event_handler.pipeline.pending_count)
+    if watch_backend() == "polling":
+        # 系统文件事件不可靠的卷（网络共享、外接磁盘等）对照目录状态轮询
+        observer = watches = PollingWatcher(event_handler, base_wechat_dir)
+    else:
+        observer = Observer()
+        # 只监听可能包含需要备份文件的目录，新目录出现或规则变化时增删监听
+        watches = WatchManager(observer, event_handler, base_wechat_dir)
+        event_handler.watches = watches
+    watches.refresh()
+    metrics.WATCHED_DIRECTORIES.set_function(lambda: len(watches))
     observer.start()
 
+    # 监听开始后再核对停止期间（首次运行时为全量同步期间）的变化，核对过程中产生的新文件由事件处理
+    try:
+        reconcile_changes(base_wechat_dir, backup_dir, base_wechat_dir, scheduler)
+        # 停止期间新建的会话目录在核对后才有记录，补充监听并再遍历一次，覆盖建立监听前写入的文件
+        for dir_path in watches.refresh(force=True):
+            process_directory(dir_path, backup_dir, base_wechat_dir, scheduler)
+    except Exception as e:
+        logging.error(f"启动核对过程中发生错误: {e}", exc_info=True)
+
     try:
         while True:
             time.sleep(1)
+            # 管理端修改规则后只会递增配置版本，匹配器在下次使用时按新版本重建
+            if poll_config():
+                logging.info("检测到配置变化，已重新加载备份规则")
+                # 新纳入的目录中已有的文件不会产生事件，建立监听后补一次遍历
+                for dir_path in watches.refresh():
+                    process_directory(dir_path, backup_dir, base_wechat_dir, scheduler)
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    event_handler.stop()
+    scheduler.shutdown()
+    close_pack_stores()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file